@@ -0,0 +1,407 @@
+"""Fábrica do agente: concentra as dependências pesadas (LangGraph, ChromaDB, OpenAI e SQLAlchemy).
+
+Este módulo é importado sob demanda por `main.py`, para que o processo da API
+suba rápido e responda a health checks sem carregar o subsistema do agente.
+"""
+
+import os
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional
+
+import openai
+from openai import OpenAI
+from dotenv import load_dotenv
+from langgraph.graph import END, StateGraph
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+import chromadb
+from chromadb.utils import embedding_functions
+
+from db.profile import TableProfiler
+from model.query import SQLQuery
+from model.state import GraphState
+from model.validation import ValidationDecision
+from utils import cancellation, metrics, tracing
+from utils.answers import render_simple_answer
+from utils.cache import SingleFlightCache
+from utils.llm import DeadlineExceededError, LLMUnavailableError, ResilientCaller
+from utils.prompt import build_sql_messages, join_schemas, record_usage
+from utils.results import MAX_INLINE_ROWS, to_columnar
+
+load_dotenv()
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+CHAT_MODEL = "gpt-4o"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Por quanto tempo o resultado de um SQL é reaproveitado entre perguntas de um mesmo batch
+BATCH_RESULT_TTL = 300.0
+# Respostas por template para resultados simples (desative com AGENT_FAST_ANSWERS=0)
+FAST_ANSWERS = os.getenv("AGENT_FAST_ANSWERS", "1") != "0"
+
+# Timeout (s) de cada nó; o valor efetivo é limitado pelo deadline restante da requisição
+NODE_TIMEOUTS = {"generate_sql": 30.0, "validate_relevance": 15.0, "generate_final_answer": 30.0, "summarize": 20.0}
+DEFAULT_NODE_TIMEOUT = 30.0
+# Deadline total (s) de uma pergunta, do roteamento à resposta final
+REQUEST_DEADLINE = float(os.getenv("AGENT_REQUEST_DEADLINE", "60"))
+# Modelo usado quando o principal está indisponível (circuito aberto ou retries esgotados)
+FALLBACK_MODEL = os.getenv("AGENT_FALLBACK_MODEL")
+
+_client = None
+_client_lock = threading.Lock()
+_chroma_client = None
+llm_caller = ResilientCaller(
+    retryable=(openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError),
+    max_retries=int(os.getenv("AGENT_LLM_MAX_RETRIES", "2")),
+    hedge=os.getenv("AGENT_LLM_HEDGE", "0") == "1",
+)
+
+def get_client() -> OpenAI:
+    """Cria o cliente da OpenAI na primeira chamada."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Os retries ficam a cargo do `llm_caller`, não do SDK
+            _client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return _client
+
+def get_chroma_client():
+    """Cliente em memória do ChromaDB, compartilhado por todas as coleções do processo."""
+    global _chroma_client
+    with _client_lock:
+        if _chroma_client is None:
+            _chroma_client = chromadb.Client()
+    return _chroma_client
+
+def drop_collection(collection) -> None:
+    """Remove uma coleção que não é mais usada por nenhum agente."""
+    try:
+        get_chroma_client().delete_collection(collection.name)
+    except Exception as e:
+        print(f"Falha ao remover a coleção {collection.name}: {e}")
+
+def create_chat_completion(node: str, deadline: float = None, **kwargs):
+    """
+    Chama a API de chat pela camada resiliente (timeout do nó limitado pelo deadline da requisição,
+    retries, circuit breaker e hedging) e contabiliza o uso de tokens.
+    """
+    def call(model: str):
+        def attempt(timeout: float):
+            return get_client().chat.completions.create(**{**kwargs, "model": model}, timeout=timeout)
+        return llm_caller.call(f"{model}/chat.completions", attempt, NODE_TIMEOUTS.get(node, DEFAULT_NODE_TIMEOUT), deadline,
+                               cancel=cancellation.current())
+
+    model, start = kwargs["model"], time.perf_counter()
+    trace = tracing.current()
+    try:
+        try:
+            response = call(model)
+        except DeadlineExceededError:
+            # Deadline esgotado não é falha do provedor: o modelo reserva falharia pelo mesmo motivo
+            raise
+        except LLMUnavailableError:
+            if not FALLBACK_MODEL or FALLBACK_MODEL == model:
+                raise
+            metrics.increment("llm_fallbacks")
+            model = FALLBACK_MODEL
+            response = call(model)
+    except Exception as e:
+        if trace is not None:
+            trace.record_llm_call(node, model, time.perf_counter() - start, error=e)
+        raise
+    if trace is not None:
+        trace.record_llm_call(node, model, time.perf_counter() - start, response)
+    record_usage(getattr(response, "usage", None))
+    return response
+
+def interrupt_statement(conn) -> None:
+    """Cancela o statement em execução na conexão pelo driver (sqlite3: interrupt; psycopg: cancel)."""
+    driver_connection = conn.connection.driver_connection
+    cancel = getattr(driver_connection, "interrupt", None) or getattr(driver_connection, "cancel", None)
+    if cancel is None:
+        return
+    cancel()
+    metrics.increment("db_statements_cancelled")
+
+# (Nós do Grafo com correções)
+def route_tables_node(state: GraphState, chroma_collection) -> Dict:
+    # No modo batch as tabelas já vêm roteadas (todas as perguntas embedadas de uma vez)
+    if state.get("tables"):
+        return {"retries": 0, "error": None}
+    question = state["question"]
+    results = chroma_collection.query(query_texts=[question], n_results=5) # Aumentado para 5 para mais contexto
+    retrieved_schemas = [meta['schema'] for meta in results['metadatas'][0]]
+    # Ordem determinística: o bloco de schema faz parte do prefixo cacheado do prompt
+    return {"tables": join_schemas(retrieved_schemas), "retries": 0, "error": None}
+
+def generate_sql_node(state: GraphState, dialect: str, profiler: TableProfiler = None) -> Dict:
+    print("--- GERANDO SQL ---")
+
+    # Recuperando exemplos (sugestão do ponto 3)
+    # few_shot_examples = buscar_exemplos_do_chroma(state["question"])
+
+    # Regras fixas -> schema -> histórico -> pergunta/erro (ver utils/prompt.py)
+    messages = build_sql_messages(
+        dialect=dialect,
+        tables=state['tables'],
+        question=state['question'],
+        error=state.get('error'),
+        history=state.get('history', []),
+        hints=profiler.grounding_hints(state['question']) if profiler else None,
+    )
+    
+    response = create_chat_completion(
+        node="generate_sql",
+        deadline=state.get('deadline'),
+        model=CHAT_MODEL,
+        messages=messages,
+        tools=[{"type": "function", "function": {"name": "sql_query", "parameters": SQLQuery.model_json_schema()}}],
+        tool_choice={"type": "function", "function": {"name": "sql_query"}}
+    )
+    sql_query = SQLQuery(**json.loads(response.choices[0].message.tool_calls[0].function.arguments)).query
+    return {"sql_query": sql_query, "error": None}
+
+def execute_sql_node(state: GraphState, engine) -> dict:
+    print(f"--- EXECUTANDO SQL (Tentativa {state.get('retries', 0) + 1}) ---")
+    print(f"Query: {state['sql_query']}")
+    if state.get("retries", 0) >= 3: return {"error": "Limite de tentativas atingido."}
+    try:
+        def run_query():
+            token = cancellation.current()
+            with engine.connect() as conn:
+                if token is None:
+                    result = conn.execute(text(state["sql_query"]))
+                    return list(result.keys()), result.mappings().all()
+                # Se a execução for cancelada, o statement é interrompido no banco
+                with token.on_cancel(partial(interrupt_statement, conn)):
+                    result = conn.execute(text(state["sql_query"]))
+                    return list(result.keys()), result.mappings().all()
+
+        # Perguntas de um mesmo batch que geram o mesmo SQL compartilham uma única execução
+        result_cache = state.get("result_cache")
+        if result_cache is not None:
+            columns, result = result_cache.get_or_compute(state["sql_query"], run_query)
+        else:
+            columns, result = run_query()
+        # As linhas também seguem estruturadas no estado, para o payload colunar da resposta
+        rows = [tuple(row.values()) for row in result[:MAX_INLINE_ROWS]]
+        return {"query_result": str(result), "query_data": to_columnar(columns, rows, row_count=len(result)), "error": None}
+    except SQLAlchemyError as e:
+        # Statement interrompido pelo cancelamento não é erro do SQL: não gera nova tentativa
+        cancellation.raise_if_cancelled()
+        # CORREÇÃO: Retorna um erro mais detalhado
+        error_message = f"Erro de banco de dados ao executar a query. Detalhes: {e.orig}"
+        print(f"ERRO SQL: {error_message}")
+        return {"error": error_message, "retries": state.get("retries", 0) + 1}
+
+# CORREÇÃO: Nó de validação mais robusto
+def validate_relevance_node(state: GraphState) -> Dict:
+    print("--- VALIDANDO RELEVÂNCIA ---")
+    # Se o passo anterior deu erro, não há o que validar. Apenas passe o erro adiante.
+    if state.get("error"):
+        return {}
+        
+    system_prompt = "Você é um assistente de validação. Analise a pergunta do usuário, a query SQL executada e o resultado obtido. Sua única tarefa é decidir se o resultado responde adequadamente à pergunta original. Responda estritamente com 'SIM' ou 'NÃO'."
+    user_prompt = f"A pergunta original foi: '{state['question']}'.\nA query SQL executada foi: '{state['sql_query']}'.\nO resultado obtido foi: '{state['query_result']}'.\n\nEste resultado responde à pergunta?"
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+    
+    response = create_chat_completion(
+        node="validate_relevance",
+        deadline=state.get('deadline'),
+        model=CHAT_MODEL, 
+        messages=messages, 
+        tools=[{"type": "function", "function": {"name": "validation", "parameters": ValidationDecision.model_json_schema()}}], 
+        tool_choice={"type": "function", "function": {"name": "validation"}}
+    )
+    decision = ValidationDecision(**json.loads(response.choices[0].message.tool_calls[0].function.arguments)).decision
+    if decision.upper() == "NÃO":
+        return {"error": "O resultado da query não foi relevante para a pergunta.", "retries": state.get("retries", 0) + 1}
+    return {"error": None}
+
+# CORREÇÃO: Nó de resposta final mais robusto
+def generate_final_answer_node(state: GraphState) -> Dict:
+    print("--- GERANDO RESPOSTA FINAL ---")
+    # Se chegamos aqui com um erro, significa que o limite de tentativas foi atingido.
+    if state.get("error"):
+        return {"final_answer": f"Desculpe, não consegui processar sua pergunta após algumas tentativas. Último erro encontrado: {state['error']}"}
+
+    # Resultados simples (escalar, linha única, lista curta) são respondidos por template, sem LLM
+    metrics.increment("final_answers")
+    if FAST_ANSWERS:
+        answer = render_simple_answer(state['question'], state.get('query_data'))
+        if answer is not None:
+            metrics.increment("final_answers_fast_path")
+            return {"final_answer": answer}
+
+    system_prompt = "Você é um assistente prestativo. Sua tarefa é formular uma resposta clara e concisa em linguagem natural para o usuário, com base na pergunta original e nos dados retornados pela consulta ao banco de dados."
+    user_prompt = f"Pergunta do usuário: '{state['question']}'.\nDados obtidos: '{state['query_result']}'.\n\nFormule a resposta final."
+    messages = [{"role": "system", "content": system_prompt}, *state.get('history', []), {"role": "user", "content": user_prompt}]
+
+    response = create_chat_completion(node="generate_final_answer", deadline=state.get('deadline'), model=CHAT_MODEL, messages=messages)
+    return {"final_answer": response.choices[0].message.content}
+
+def decide_next_node(state: GraphState) -> str:
+    if state.get("error"):
+        if state.get("retries", 0) >= 3:
+            # CORREÇÃO: Se atingir o limite, vá para o nó de resposta final para dar um feedback útil
+            return "Limite de Tentativas Atingido"
+        return "Erro (SQL ou Validação)"
+    return "Sucesso na Validação"
+
+def summarize_conversation(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
+    
+    prompt = f"""
+    Resuma a seguinte conversa entre um usuário e um assistente de forma concisa. 
+    O resumo deve capturar os principais pontos, perguntas e respostas para que o contexto seja mantido em futuras interações, mas de forma muito mais curta.
+
+    Conversa a ser resumida:
+    {history_str}
+    """
+    
+    try:
+        response = create_chat_completion(node="summarize", model=CHAT_MODEL, messages=[{"role": "user", "content": prompt}])
+        summary = response.choices[0].message.content
+        return [{"role": "system", "content": f"Resumo da conversa anterior: {summary}"}, *history[-4:]]
+    except Exception as e:
+        print(f"Erro ao resumir: {e}")
+        return history
+
+def reflect_schemas(db_engine, table_names: List[str]) -> Dict[str, str]:
+    """Reflete o DDL das tabelas informadas."""
+    inspector = inspect(db_engine)
+    return {
+        name: f"CREATE TABLE {name} (\n" + ",\n".join([f"  {col['name']} {str(col['type'])}" for col in inspector.get_columns(name)]) + "\n);"
+        for name in table_names if inspector.get_columns(name)
+    }
+
+def build_agent(db_engine, dialect: str, tables: List, schemas: Dict[str, str], embeddings: Dict = None, trace_store=None,
+                profiler: TableProfiler = None):
+    """
+    Popula o ChromaDB, inicia o perfilador e compila o grafo. Retorna (agente, coleção, perfilador).
+    Se `embeddings` vier de um snapshot, os vetores são reaproveitados e nada é re-embedado.
+    Cada execução do agente gera um trace, gravado em `trace_store` se informado (ver utils/tracing.py).
+    Um `profiler` já em execução (mesmo banco) é reaproveitado em vez de perfilar tudo de novo.
+    """
+    embedding_func = embedding_functions.OpenAIEmbeddingFunction(api_key=OPENAI_API_KEY, model_name=EMBEDDING_MODEL)
+    # Uma coleção nova por agente: o agente anterior continua atendendo as requisições em andamento
+    chroma_collection = get_chroma_client().create_collection(
+        name=f"dynamic_db_agent_memory_{uuid.uuid4().hex[:12]}", embedding_function=embedding_func
+    )
+    
+    ids = [f"{t.table_name}_doc" for t in tables]
+    if embeddings and embeddings.get("vectors"):
+        chroma_collection.add(
+            ids=embeddings["ids"],
+            documents=embeddings["documents"],
+            metadatas=embeddings["metadatas"],
+            embeddings=embeddings["vectors"]
+        )
+    else:
+        # Agora, esta chamada nunca terá listas vazias
+        chroma_collection.add(
+            documents=[t.description for t in tables],
+            metadatas=[{"table_name": t.table_name, "schema": schemas.get(t.table_name, "")} for t in tables],
+            ids=ids
+        )
+    
+    # Perfil das tabelas em segundo plano para ancorar os literais das queries
+    if profiler is None:
+        profiler = TableProfiler(db_engine, list(schemas.keys()))
+        profiler.start()
+
+    workflow = StateGraph(GraphState)
+    # ... (adição de nós e arestas do workflow sem alterações)
+    nodes = {
+        "route_tables": partial(route_tables_node, chroma_collection=chroma_collection),
+        "generate_sql": partial(generate_sql_node, dialect=dialect, profiler=profiler),
+        "execute_sql": partial(execute_sql_node, engine=db_engine),
+        "validate_relevance": validate_relevance_node,
+        "generate_final_answer": generate_final_answer_node,
+    }
+    for name, node in nodes.items():
+        workflow.add_node(name, tracing.traced_node(name, cancellation.cancellable(node)))
+
+    workflow.set_entry_point("route_tables")
+    workflow.add_edge("route_tables", "generate_sql")
+    workflow.add_edge("generate_sql", "execute_sql")
+    workflow.add_edge("execute_sql", "validate_relevance")
+    
+    workflow.add_conditional_edges("validate_relevance", decide_next_node, {
+        "Erro (SQL ou Validação)": "generate_sql",
+        "Sucesso na Validação": "generate_final_answer",
+        "Limite de Tentativas Atingido": "generate_final_answer"
+    })
+    workflow.add_edge("generate_final_answer", END)
+    
+    return tracing.TracedAgent(workflow.compile(), trace_store), chroma_collection, profiler
+
+def run_batch(agent, chroma_collection, questions: List[str], concurrency: int = 4,
+              run_slot: Optional[Callable[[str], ContextManager]] = None) -> Iterator[Dict]:
+    """
+    Executa várias perguntas e gera um resultado por pergunta, na ordem em que terminam.
+    Todas as perguntas são embedadas em uma única requisição, as execuções do grafo
+    rodam com concorrência limitada e perguntas repetidas são executadas uma só vez.
+    `run_slot(pergunta)`, se informado, envolve cada execução (ex: a admissão da pergunta).
+    Se o consumidor parar antes do fim (ex: o cliente desconectou), o restante é cancelado.
+    """
+    token = cancellation.CancelToken()
+    # Resultados compartilhados apenas entre as perguntas deste batch e descartados ao final
+    result_cache = SingleFlightCache(ttl=BATCH_RESULT_TTL)
+    unique_questions = list(dict.fromkeys(questions))
+    positions = defaultdict(list)
+    for index, question in enumerate(questions):
+        positions[question].append(index)
+
+    # Uma única chamada de embedding para o batch inteiro
+    routed = chroma_collection.query(query_texts=unique_questions, n_results=5)
+    tables = {
+        question: join_schemas(meta['schema'] for meta in metadatas)
+        for question, metadatas in zip(unique_questions, routed['metadatas'])
+    }
+
+    def invoke(question: str) -> Dict:
+        # O deadline conta a partir da execução: a espera na admissão não consome o tempo do grafo
+        initial_state = {
+            "question": question, "history": [], "tables": tables[question], "result_cache": result_cache,
+            "deadline": time.time() + REQUEST_DEADLINE,
+        }
+        return agent.invoke(initial_state, {"recursion_limit": 15})
+
+    def run(question: str) -> Dict:
+        with cancellation.bind(token):
+            token.raise_if_cancelled()
+            if run_slot is None:
+                return invoke(question)
+            with run_slot(question):
+                return invoke(question)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(run, question): question for question in unique_questions}
+        pending = set(futures)
+        try:
+            for future in as_completed(futures):
+                pending.discard(future)
+                question = futures[future]
+                try:
+                    final_state = future.result()
+                    item = {
+                        "status": "error" if final_state.get("error") else "ok",
+                        "answer": final_state.get("final_answer"),
+                        "sql_query": final_state.get("sql_query"),
+                        "error": final_state.get("error"),
+                    }
+                except Exception as e:
+                    item = {"status": "error", "answer": None, "sql_query": None, "error": str(e)}
+                metrics.increment("batch_questions", len(positions[question]))
+                for index in positions[question]:
+                    yield {"index": index, "question": question, **item}
+        finally:
+            result_cache.clear()
+            if pending:
+                token.cancel("batch interrompido")
+                metrics.increment("batch_questions_abandoned", sum(len(positions[futures[f]]) for f in pending))
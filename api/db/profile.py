@@ -0,0 +1,265 @@
+"""Estatísticas das tabelas e índice de valores distintos para ancorar os literais do SQL gerado."""
+
+import re
+import threading
+import time
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+
+from sqlalchemy import (ARRAY, JSON, Boolean, Integer, LargeBinary, MetaData, Table, case, distinct, func,
+                        literal_column, select, text)
+
+# Colunas com até este número de valores distintos entram no índice de valores
+LOW_CARDINALITY_LIMIT = 200
+# Amostra usada para detectar o formato de datas em colunas de texto
+DATE_SAMPLE_SIZE = 50
+# Similaridade mínima entre um termo da pergunta e um valor indexado
+FUZZY_CUTOFF = 0.82
+# Sem estatísticas no catálogo, o marcador (maior id/rowid) só detecta inserções: alterações e
+# remoções de valores são capturadas refazendo o perfil completo a cada este intervalo (s)
+FULL_REPROFILE_INTERVAL = 1800.0
+# Tipos sem ordenação (MIN/MAX falham, ex: boolean e json no PostgreSQL)
+UNORDERED_TYPES = (Boolean, JSON, ARRAY, LargeBinary)
+
+# Marcador de mudança lido do catálogo, sem varrer a tabela
+_CATALOG_MARKERS = {
+    # Contadores de linhas inseridas/alteradas/removidas mantidos pelo coletor de estatísticas
+    "postgresql": "SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables"
+                  " WHERE relname = :name AND schemaname = current_schema()",
+    "mysql": "SELECT CONCAT(COALESCE(table_rows, ''), '/', COALESCE(update_time, '')) FROM information_schema.tables"
+             " WHERE table_schema = DATABASE() AND table_name = :name",
+}
+_CATALOG_MARKERS["mariadb"] = _CATALOG_MARKERS["mysql"]
+
+DATE_FORMATS = {
+    r"\d{4}-\d{2}-\d{2}": "YYYY-MM-DD",
+    r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2})?": "YYYY-MM-DD HH:MM[:SS]",
+    r"\d{2}/\d{2}/\d{4}": "DD/MM/YYYY",
+    r"\d{4}/\d{2}/\d{2}": "YYYY/MM/DD",
+    r"\d{2}-\d{2}-\d{4}": "DD-MM-YYYY",
+}
+
+
+def normalize(value: str) -> str:
+    """Remove acentos e caixa para a comparação aproximada."""
+    value = unicodedata.normalize("NFKD", str(value))
+    return "".join(c for c in value if not unicodedata.combining(c)).lower().strip()
+
+
+def detect_date_format(samples: List[str]) -> Optional[str]:
+    """Retorna o formato de data seguido por todas as amostras, se houver."""
+    samples = [str(s) for s in samples if s is not None]
+    if not samples:
+        return None
+    for pattern, label in DATE_FORMATS.items():
+        if all(re.fullmatch(pattern, s) for s in samples):
+            return label
+    return None
+
+
+class TableProfiler:
+    """Perfila as tabelas configuradas e mantém um índice dos valores de baixa cardinalidade.
+
+    O perfil é refeito em segundo plano, apenas para as tabelas que mudaram desde a
+    última passada. A mudança é detectada por um marcador barato (estatísticas do
+    catálogo ou o maior id/rowid), sem contar as linhas da tabela. O maior id/rowid não
+    muda com UPDATE/DELETE; por isso essas tabelas também são reperfiladas a cada
+    FULL_REPROFILE_INTERVAL segundos.
+    """
+
+    def __init__(self, engine, table_names: List[str], refresh_interval: float = 300.0):
+        self.engine = engine
+        self.table_names = list(table_names)
+        self.refresh_interval = refresh_interval
+        self.stats: Dict[str, Dict[str, dict]] = {}
+        # (valor normalizado, tabela, coluna, valor original)
+        self._index: List[tuple] = []
+        self._markers: Dict[str, tuple] = {}
+        self._profiled_at: Dict[str, float] = {}
+        self._tables: Dict[str, Table] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Perfilamento ---
+    def _table(self, table_name: str) -> Table:
+        if table_name not in self._tables:
+            self._tables[table_name] = Table(table_name, MetaData(), autoload_with=self.engine)
+        return self._tables[table_name]
+
+    def _change_marker(self, conn, table: Table) -> tuple:
+        """
+        (tipo, valor) que muda quando a tabela recebe escritas, obtido sem varrer a tabela.
+        O tipo "catalog" detecta qualquer escrita; "insert" e "count" não detectam UPDATE.
+        """
+        query = _CATALOG_MARKERS.get(self.engine.dialect.name)
+        if query is not None:
+            marker = conn.execute(text(query), {"name": table.name}).scalar()
+            if marker is not None:
+                return "catalog", marker
+        # Chave primária inteira ou rowid: MAX resolvido pelo índice (detecta inserções)
+        primary_key = list(table.primary_key.columns)
+        if len(primary_key) == 1 and isinstance(primary_key[0].type, Integer):
+            return "insert", conn.execute(select(func.max(primary_key[0]))).scalar()
+        if self.engine.dialect.name == "sqlite":
+            try:
+                return "insert", conn.execute(select(func.max(literal_column("rowid"))).select_from(table)).scalar()
+            except Exception:
+                pass  # Tabela WITHOUT ROWID
+        return "count", conn.execute(select(func.count()).select_from(table)).scalar()
+
+    def _is_current(self, table_name: str, marker: tuple) -> bool:
+        if table_name not in self.stats or self._markers.get(table_name) != marker:
+            return False
+        if marker[0] == "catalog":
+            return True
+        return time.monotonic() - self._profiled_at.get(table_name, 0.0) < FULL_REPROFILE_INTERVAL
+
+    def _profile_column(self, conn, table: Table, column) -> dict:
+        ordered = not isinstance(column.type, UNORDERED_TYPES)
+        aggregates = [
+            func.count().label("total"),
+            func.count(distinct(column)).label("distinct_count"),
+            func.sum(case((column.is_(None), 1), else_=0)).label("nulls"),
+        ]
+        if ordered:
+            aggregates += [func.min(column).label("min_value"), func.max(column).label("max_value")]
+        row = conn.execute(select(*aggregates).select_from(table)).mappings().one()
+        total = row["total"] or 0
+        stats = {
+            "type": str(column.type),
+            "distinct_count": row["distinct_count"],
+            "null_ratio": (row["nulls"] or 0) / total if total else 0.0,
+            "min": row["min_value"] if ordered else None,
+            "max": row["max_value"] if ordered else None,
+            "date_format": None,
+            "values": [],
+        }
+        if isinstance(stats["min"], str):
+            distinct_values = select(column).distinct().where(column.is_not(None))
+            samples = conn.execute(distinct_values.limit(DATE_SAMPLE_SIZE)).scalars().all()
+            stats["date_format"] = detect_date_format(samples)
+            if stats["date_format"] is None and row["distinct_count"] <= LOW_CARDINALITY_LIMIT:
+                stats["values"] = conn.execute(distinct_values).scalars().all()
+        return stats
+
+    def _profile_table(self, table: Table) -> Dict[str, dict]:
+        profile = {}
+        for column in table.columns:
+            # Uma conexão por coluna: no PostgreSQL um erro invalida a transação inteira
+            try:
+                with self.engine.connect() as conn:
+                    profile[column.name] = self._profile_column(conn, table, column)
+            except Exception as e:
+                print(f"Erro ao perfilar {table.name}.{column.name}: {e}")
+        return profile
+
+    def refresh(self) -> List[str]:
+        """Atualiza o perfil das tabelas alteradas. Retorna as tabelas reprocessadas."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> List[str]:
+        refreshed = []
+        for table_name in list(self.table_names):
+            try:
+                table = self._table(table_name)
+                with self.engine.connect() as conn:
+                    marker = self._change_marker(conn, table)
+                if self._is_current(table_name, marker):
+                    continue
+                profile = self._profile_table(table)
+            except Exception as e:
+                # Uma tabela com problema não impede o perfil das demais
+                print(f"Erro ao perfilar a tabela {table_name}: {e}")
+                continue
+            with self._lock:
+                self.stats[table_name] = profile
+                self._markers[table_name] = marker
+                self._profiled_at[table_name] = time.monotonic()
+            refreshed.append(table_name)
+        if refreshed:
+            self._rebuild_index()
+        return refreshed
+
+    def reset(self, table_names: List[str], changed: List[str]) -> None:
+        """
+        Passa a perfilar `table_names` (ex: após uma mudança de schema). O perfil das tabelas
+        alteradas ou removidas é descartado e as alteradas são reprocessadas em seguida, em
+        segundo plano; o das demais é mantido.
+        """
+        stale = set(changed) | (set(self.table_names) - set(table_names))
+        with self._lock:
+            self.table_names = list(table_names)
+            for name in stale:
+                self.stats.pop(name, None)
+                self._markers.pop(name, None)
+                self._tables.pop(name, None)
+        self._rebuild_index()
+        if changed:
+            threading.Thread(target=self._refresh_logged, name="table-profiler-reset", daemon=True).start()
+
+    def _rebuild_index(self) -> None:
+        with self._lock:
+            self._index = [
+                (normalize(value), table_name, column, value)
+                for table_name, columns in self.stats.items()
+                for column, stats in columns.items()
+                for value in stats["values"]
+            ]
+
+    # --- Execução em segundo plano ---
+    def _refresh_logged(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Erro ao perfilar tabelas: {e}")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._refresh_logged()
+            self._stop.wait(self.refresh_interval)
+
+    def start(self) -> None:
+        """Inicia o perfilador em uma thread daemon."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="table-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # --- Consulta ---
+    def lookup(self, question: str, limit: int = 10) -> List[tuple]:
+        """Retorna (tabela, coluna, valor) cujos valores se parecem com termos da pergunta."""
+        words = re.findall(r"\w+", normalize(question))
+        # Termos de 1 a 3 palavras cobrem valores como 'Teclado Mecânico' ou 'Rio de Janeiro'
+        terms = {" ".join(words[i:i + n]) for n in (1, 2, 3) for i in range(len(words) - n + 1)}
+        terms = {t for t in terms if len(t) >= 3}
+
+        with self._lock:
+            index = list(self._index)
+
+        matches = {}
+        for normalized, table_name, column, value in index:
+            best = max((SequenceMatcher(None, normalized, term).ratio() for term in terms), default=0.0)
+            if best >= FUZZY_CUTOFF:
+                key = (table_name, column, value)
+                matches[key] = max(best, matches.get(key, 0.0))
+        ranked = sorted(matches.items(), key=lambda item: (-item[1], item[0][0], item[0][1], str(item[0][2])))
+        return [key for key, _ in ranked[:limit]]
+
+    def grounding_hints(self, question: str) -> str:
+        """Monta o bloco de valores reais e formatos de data para o prompt de geração de SQL."""
+        lines = [f'- {table}.{column} = "{value}"' for table, column, value in self.lookup(question)]
+        with self._lock:
+            for table_name, columns in sorted(self.stats.items()):
+                for column, stats in columns.items():
+                    if stats["date_format"]:
+                        lines.append(f"- {table_name}.{column} usa o formato de data {stats['date_format']} "
+                                     f"(de {stats['min']} a {stats['max']})")
+        return "\n".join(lines)
@@ -0,0 +1,119 @@
+"""Detecção de mudanças no schema das tabelas configuradas no agente.
+
+A verificação periódica é barata: no SQLite, `PRAGMA schema_version` muda a cada DDL e,
+enquanto não mudar, nada mais é consultado. Nos demais bancos, uma única consulta ao
+catálogo (information_schema.columns) das tabelas configuradas. Só quando algo muda as
+tabelas são comparadas uma a uma, e `on_change` recebe apenas as que foram alteradas.
+"""
+
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import bindparam, inspect, text
+
+_CATALOG_FILTERS = {
+    "postgresql": "table_schema = current_schema()",
+    "mysql": "table_schema = DATABASE()",
+    "mariadb": "table_schema = DATABASE()",
+}
+
+
+def schema_version(engine) -> Optional[int]:
+    """Contador global de DDL do banco, se o dialeto tiver um (SQLite); None caso contrário."""
+    if engine.dialect.name != "sqlite":
+        return None
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA schema_version").scalar()
+
+
+def _digest(parts) -> str:
+    return hashlib.sha256("\n".join(map(str, parts)).encode("utf-8")).hexdigest()[:16]
+
+
+def table_fingerprints(engine, table_names: List[str]) -> Dict[str, str]:
+    """Hash da definição de cada tabela existente (tabelas removidas ficam fora do resultado)."""
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        query = text("SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN :names")
+        with engine.connect() as conn:
+            rows = conn.execute(query.bindparams(bindparam("names", expanding=True)), {"names": table_names}).all()
+        return {name: _digest([sql]) for name, sql in rows}
+
+    try:
+        condition = _CATALOG_FILTERS.get(dialect)
+        query = text(
+            "SELECT table_name, column_name, data_type, is_nullable FROM information_schema.columns"
+            f" WHERE table_name IN :names{f' AND {condition}' if condition else ''}"
+            " ORDER BY table_name, ordinal_position"
+        )
+        with engine.connect() as conn:
+            rows = conn.execute(query.bindparams(bindparam("names", expanding=True)), {"names": table_names}).all()
+        columns: Dict[str, list] = {}
+        for table_name, *definition in rows:
+            columns.setdefault(table_name, []).append(definition)
+        return {name: _digest(definition) for name, definition in columns.items()}
+    except Exception:
+        # Bancos sem information_schema: reflexão pelo SQLAlchemy (mais cara, mas genérica)
+        inspector = inspect(engine)
+        return {
+            name: _digest((c["name"], c["type"], c["nullable"]) for c in inspector.get_columns(name))
+            for name in table_names if inspector.has_table(name)
+        }
+
+
+class SchemaWatcher:
+    """Verifica o schema a cada `interval` segundos em uma thread daemon e avisa as tabelas alteradas."""
+
+    def __init__(self, engine, table_names: List[str], on_change: Callable[[List[str]], None], interval: float = 30.0):
+        self.engine = engine
+        self.table_names = list(table_names)
+        self.on_change = on_change
+        self.interval = interval
+        self._version = None
+        self._fingerprints: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def seed(self, other: "SchemaWatcher") -> None:
+        """
+        Parte da última verificação de `other` (mesmo banco), em vez de comparar todas as tabelas
+        na primeira passada. Com a mesma lista de tabelas, também herda a versão do schema.
+        """
+        self._fingerprints = {name: value for name, value in other._fingerprints.items() if name in self.table_names}
+        self._version = other._version if set(other.table_names) == set(self.table_names) else None
+
+    def check(self) -> List[str]:
+        """Retorna as tabelas alteradas, criadas ou removidas desde a última verificação."""
+        version = schema_version(self.engine)
+        if version is not None and version == self._version:
+            return []
+        fingerprints = table_fingerprints(self.engine, self.table_names)
+        changed = [name for name in self.table_names if fingerprints.get(name) != self._fingerprints.get(name)]
+        self._version, self._fingerprints = version, fingerprints
+        return changed
+
+    def _run(self) -> None:
+        # A primeira verificação marca todas as tabelas como alteradas: quem recebe compara com o
+        # schema configurado, o que também detecta mudanças feitas enquanto a API estava parada
+        while not self._stop.is_set():
+            try:
+                changed = self.check()
+                if changed:
+                    self.on_change(changed)
+            except Exception as e:
+                print(f"Erro ao verificar o schema: {e}")
+                # Sem referência: a próxima verificação compara todas as tabelas de novo
+                self._version, self._fingerprints = None, {}
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        """Inicia a verificação em uma thread daemon."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="schema-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
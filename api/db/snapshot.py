@@ -0,0 +1,139 @@
+"""Snapshot versionado da configuração do agente, para restaurá-lo sem reconfigurar após um reinício."""
+
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy.engine import URL, make_url
+
+# Incrementar quando o formato do snapshot mudar; snapshots antigos são ignorados
+SNAPSHOT_VERSION = 1
+# Variável de ambiente com a senha do banco (nunca gravada no snapshot)
+DB_PASSWORD_ENV = "AGENT_DB_PASSWORD"
+# Parâmetros da query string que carregam segredos (comparados sem caixa)
+SECRET_QUERY_KEYS = {"password", "pwd", "passwd", "sslpassword", "secret", "token", "access_token", "api_key", "apikey"}
+# Pares PWD=...; dentro de strings ODBC (odbc_connect), com ou sem chaves
+_ODBC_SECRET = re.compile(r"(?i)\b(pwd|password)\s*=\s*(\{(?:[^}]|\}\})*\}|[^;]*);?")
+
+
+def _strip_odbc_secret(value: str) -> str:
+    return _ODBC_SECRET.sub("", value)
+
+
+def credentials_reference(connection_string: str) -> str:
+    """Retorna a string de conexão sem a senha (inclusive na query string), que é resolvida pelo ambiente na restauração."""
+    url = make_url(connection_string)
+    query = {}
+    for key, value in url.query.items():
+        if key.lower() in SECRET_QUERY_KEYS:
+            continue
+        if key.lower() == "odbc_connect":
+            value = tuple(map(_strip_odbc_secret, value)) if isinstance(value, tuple) else _strip_odbc_secret(value)
+        query[key] = value
+    url = URL.create(url.drivername, username=url.username, host=url.host, port=url.port,
+                     database=url.database, query=query)
+    return url.render_as_string(hide_password=False)
+
+
+def resolve_credentials(reference: str, password: Optional[str] = None) -> str:
+    """Reconstrói a string de conexão a partir da referência do snapshot."""
+    password = password if password is not None else os.getenv(DB_PASSWORD_ENV)
+    url = make_url(reference)
+    if password and "odbc_connect" in url.query:
+        # Com odbc_connect a senha vai dentro da string ODBC, não na URL
+        odbc = url.query["odbc_connect"].rstrip(";")
+        escaped = password.replace("}", "}}")
+        url = url.update_query_dict({"odbc_connect": f"{odbc};PWD={{{escaped}}};"})
+    elif password and url.password is None:
+        url = url.set(password=password)
+    return url.render_as_string(hide_password=False)
+
+
+def _secrets(url: URL) -> tuple:
+    """Segredos contidos na URL: senha, parâmetros secretos da query e PWD da string ODBC."""
+    query_secrets = tuple(sorted((k.lower(), str(v)) for k, v in url.query.items() if k.lower() in SECRET_QUERY_KEYS))
+    odbc_secret = None
+    match = _ODBC_SECRET.search(str(url.query.get("odbc_connect", "")))
+    if match:
+        odbc_secret = match.group(2).strip()
+        if odbc_secret.startswith("{"):
+            odbc_secret = odbc_secret[1:-1].replace("}}", "}")
+    return url.password, query_secrets, odbc_secret
+
+
+def is_restorable(connection_string: str, password: Optional[str] = None) -> bool:
+    """Indica se a referência do snapshot, com a senha do ambiente, reconstrói as mesmas credenciais."""
+    resolved = resolve_credentials(credentials_reference(connection_string), password)
+    return _secrets(make_url(resolved)) == _secrets(make_url(connection_string))
+
+
+def fingerprint(payload: Dict) -> str:
+    """Hash estável do conteúdo da configuração (sem o timestamp), usado como versão."""
+    content = {k: v for k, v in payload.items() if k not in ("created_at", "fingerprint")}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def build_snapshot(dialect: str, connection_string: str, tables: List[Dict[str, str]],
+                   schemas: Dict[str, str], collection, embedding_model: str) -> Dict:
+    """Monta o snapshot a partir da configuração e dos embeddings já calculados na coleção."""
+    stored = collection.get(include=["embeddings", "documents", "metadatas"])
+    embeddings = stored.get("embeddings")
+    payload = {
+        "version": SNAPSHOT_VERSION,
+        "dialect": dialect,
+        "credentials_ref": credentials_reference(connection_string),
+        "tables": tables,
+        "schemas": schemas,
+        "embedding_model": embedding_model,
+        "embeddings": {
+            "ids": list(stored["ids"]),
+            "documents": list(stored["documents"]),
+            "metadatas": list(stored["metadatas"]),
+            "vectors": [list(map(float, e)) for e in embeddings] if embeddings is not None else [],
+        },
+    }
+    payload["fingerprint"] = fingerprint(payload)
+    payload["created_at"] = time.time()
+    return payload
+
+
+def write_snapshot(path: str, payload: Dict) -> None:
+    """Grava o snapshot de forma atômica (arquivo temporário + rename)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def save_snapshot(path: str, dialect: str, connection_string: str, tables: List[Dict[str, str]],
+                  schemas: Dict[str, str], collection, embedding_model: str) -> Dict:
+    """Monta e grava o snapshot, retornando-o."""
+    payload = build_snapshot(dialect, connection_string, tables, schemas, collection, embedding_model)
+    write_snapshot(path, payload)
+    return payload
+
+
+def is_compatible(payload: Dict, embedding_model: str) -> bool:
+    """Verifica se o snapshot pode ser restaurado por esta versão do código."""
+    return payload.get("version") == SNAPSHOT_VERSION and payload.get("embedding_model") == embedding_model
+
+
+def load_snapshot(path: str, embedding_model: str) -> Optional[Dict]:
+    """Lê o snapshot. Retorna None se não existir, estiver corrompido ou for incompatível."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Snapshot ignorado ({path}): {e}")
+        return None
+    if not is_compatible(payload, embedding_model):
+        print(f"Snapshot ignorado ({path}): versão ou modelo de embedding incompatível.")
+        return None
+    return payload
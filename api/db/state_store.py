@@ -0,0 +1,215 @@
+"""Armazenamento do estado compartilhado entre workers: configuração, histórico e caches.
+
+O backend é escolhido pela URL em `AGENT_STATE_STORE`:
+    memory://                    estado no próprio processo (padrão, um único worker)
+    sqlite:///db/shared_state.db arquivo SQLite compartilhado por todos os workers da máquina
+
+Outros backends (ex: Redis) podem ser registrados com `register_backend`.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+DEFAULT_STATE_STORE = "memory://"
+# Intervalo (s) mínimo entre duas limpezas das entradas expiradas do cache (feitas na escrita)
+PURGE_INTERVAL = 60.0
+
+
+class StateStore(ABC):
+    """Interface do armazenamento de estado compartilhado."""
+
+    shared = False
+
+    # --- Configuração do agente ---
+    @abstractmethod
+    def save_config(self, payload: Dict) -> str:
+        """Grava a configuração e retorna sua versão."""
+        ...
+
+    @abstractmethod
+    def load_config(self) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def config_version(self) -> Optional[str]:
+        """Versão da configuração atual. Deve ser barata: é consultada a cada requisição."""
+        ...
+
+    # --- Histórico de conversa ---
+    @abstractmethod
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        ...
+
+    @abstractmethod
+    def set_history(self, session_id: str, history: List[Dict[str, str]]) -> None:
+        ...
+
+    # --- Cache genérico com TTL ---
+    @abstractmethod
+    def cache_get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+
+class InMemoryStateStore(StateStore):
+    """Estado no próprio processo. Não funciona com múltiplos workers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._config: Optional[Dict] = None
+        self._history: Dict[str, List[Dict[str, str]]] = {}
+        self._cache: Dict[str, tuple] = {}
+        self._purged_at = time.time()
+
+    def save_config(self, payload: Dict) -> str:
+        with self._lock:
+            self._config = payload
+        return payload["fingerprint"]
+
+    def load_config(self) -> Optional[Dict]:
+        with self._lock:
+            return self._config
+
+    def config_version(self) -> Optional[str]:
+        with self._lock:
+            return self._config["fingerprint"] if self._config else None
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            return list(self._history.get(session_id, []))
+
+    def set_history(self, session_id: str, history: List[Dict[str, str]]) -> None:
+        with self._lock:
+            self._history[session_id] = list(history)
+
+    def cache_get(self, key: str) -> Any:
+        with self._lock:
+            value, expires_at = self._cache.get(key, (None, None))
+            if expires_at is not None and expires_at < time.time():
+                self._cache.pop(key, None)
+                return None
+            return value
+
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._cache[key] = (value, now + ttl if ttl else None)
+            # Entradas expiradas que nunca mais são lidas (ex: result:*) são removidas periodicamente
+            if now - self._purged_at >= PURGE_INTERVAL:
+                self._purged_at = now
+                self._cache = {k: entry for k, entry in self._cache.items() if entry[1] is None or entry[1] >= now}
+
+
+class SQLiteStateStore(StateStore):
+    """Estado em um arquivo SQLite (modo WAL), compartilhado pelos workers da mesma máquina."""
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at) WHERE expires_at IS NOT NULL")
+        self._purged_at = 0.0
+
+    @contextmanager
+    def _connect(self):
+        # Uma conexão por operação: seguro entre threads e processos
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _get(self, namespace: str, key: str) -> Any:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def _set(self, namespace: str, key: str, value: Any, expires_at: Optional[float] = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+
+    def save_config(self, payload: Dict) -> str:
+        version = payload["fingerprint"]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES ('config', ?, ?, NULL)",
+                [("current", json.dumps(payload, ensure_ascii=False)), ("version", json.dumps(version))]
+            )
+            conn.execute("COMMIT")
+        return version
+
+    def load_config(self) -> Optional[Dict]:
+        return self._get("config", "current")
+
+    def config_version(self) -> Optional[str]:
+        return self._get("config", "version")
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        return self._get("history", session_id) or []
+
+    def set_history(self, session_id: str, history: List[Dict[str, str]]) -> None:
+        self._set("history", session_id, history)
+
+    def cache_get(self, key: str) -> Any:
+        return self._get("cache", key)
+
+    def cache_set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        self._set("cache", key, value, now + ttl if ttl else None)
+        # A primeira escrita de cada processo também limpa: workers de vida curta não acumulam lixo
+        if now - self._purged_at >= PURGE_INTERVAL:
+            self._purged_at = now
+            self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """Remove as entradas expiradas e retorna quantas foram removidas."""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)).rowcount
+
+
+_BACKENDS = {
+    "memory": lambda location: InMemoryStateStore(),
+    "sqlite": lambda location: SQLiteStateStore(location),
+}
+
+
+def register_backend(scheme: str, factory) -> None:
+    """Registra um backend: `factory(location)` recebe o que vem depois de `scheme://`."""
+    _BACKENDS[scheme] = factory
+
+
+def create_state_store(url: str = DEFAULT_STATE_STORE) -> StateStore:
+    """Cria o armazenamento a partir de uma URL como `memory://` ou `sqlite:///caminho.db`."""
+    scheme, _, location = url.partition("://")
+    if scheme not in _BACKENDS:
+        raise ValueError(f"Backend de estado desconhecido: '{scheme}'. Opções: {', '.join(sorted(_BACKENDS))}")
+    # sqlite:///db/state.db -> db/state.db (mesma convenção das URLs do SQLAlchemy)
+    if scheme == "sqlite" and location.startswith("/"):
+        location = location[1:]
+    return _BACKENDS[scheme](location)
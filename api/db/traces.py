@@ -0,0 +1,82 @@
+"""Armazenamento dos traces das execuções do grafo (ver utils/tracing.py).
+
+Cada execução vira uma linha em um arquivo SQLite (modo WAL), com as colunas usadas
+na listagem e o trace completo em JSON. A retenção é limitada às `max_runs`
+execuções mais recentes.
+"""
+
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+_SUMMARY_COLUMNS = ("run_id", "started_at", "duration_ms", "question", "status", "retries",
+                    "llm_calls", "prompt_tokens", "completion_tokens", "source")
+
+
+class TraceStore:
+    """Traces em SQLite com retenção limitada."""
+
+    def __init__(self, path: str, max_runs: int = 5000):
+        self.path = path
+        self.max_runs = max_runs
+        self._saved = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY, started_at REAL NOT NULL, duration_ms REAL NOT NULL, question TEXT,"
+                " status TEXT, retries INTEGER, llm_calls INTEGER, prompt_tokens INTEGER, completion_tokens INTEGER,"
+                " source TEXT, trace TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS runs_duration ON runs (duration_ms)")
+            # Também na abertura: réplicas de vida curta podem nunca chegar a 100 gravações
+            self._prune(conn)
+
+    @contextmanager
+    def _connect(self):
+        # Uma conexão por operação: seguro entre threads e processos
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def save(self, trace: Dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO runs ({', '.join(_SUMMARY_COLUMNS)}, trace) VALUES ({', '.join('?' * (len(_SUMMARY_COLUMNS) + 1))})",
+                (*(trace.get(column) for column in _SUMMARY_COLUMNS), json.dumps(trace, ensure_ascii=False, default=str))
+            )
+            # A limpeza roda na abertura e a cada 100 gravações, para não pesar no caminho da requisição
+            self._saved += 1
+            if self._saved % 100 == 0:
+                self._prune(conn)
+
+    def prune(self) -> None:
+        """Remove as execuções mais antigas além de `max_runs`."""
+        with self._connect() as conn:
+            self._prune(conn)
+
+    def _prune(self, conn) -> None:
+        conn.execute(
+            "DELETE FROM runs WHERE started_at < (SELECT started_at FROM runs ORDER BY started_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_runs - 1,)
+        )
+
+    def slowest(self, limit: int = 20, since: Optional[float] = None) -> List[Dict]:
+        """Resumo das execuções mais lentas (opcionalmente apenas as iniciadas após `since`)."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM runs WHERE started_at >= ? ORDER BY duration_ms DESC LIMIT ?",
+                (since or 0, limit)
+            ).fetchall()
+        return [dict(zip(_SUMMARY_COLUMNS, row)) for row in rows]
+
+    def get(self, run_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT trace FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        return json.loads(row[0]) if row else None
@@ -1,23 +1,31 @@
 import os
+import asyncio
 import json
+import importlib.util
+import threading
+import time
+import uuid
 from functools import partial
-from typing import Dict, Any, List, TypedDict
+from typing import Dict, Any, List, Optional
 import traceback # Importe para obter mais detalhes do erro
 
 # --- Libs da API ---
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-import uvicorn
-
-# --- Libs do Agente (seu código original) ---
-from openai import OpenAI
 from dotenv import load_dotenv
-from langgraph.graph import END, StateGraph
-from sqlalchemy import create_engine, inspect, text
-from sqlalchemy.exc import SQLAlchemyError
-import chromadb
-from chromadb.utils import embedding_functions
+
+# O subsistema do agente (LangGraph, ChromaDB, OpenAI, SQLAlchemy) é importado
+# sob demanda via `agent_factory`; ver utils/importtime.py para o orçamento de import.
+from db.state_store import DEFAULT_STATE_STORE, create_state_store
+from db.traces import TraceStore
+from utils import metrics
+from utils.admission import AdmissionController, AdmissionRejected, PriorityGate
+from utils.cancellation import CancelToken, RunCancelledError, bind
+from utils.llm import DeadlineExceededError, LLMUnavailableError
+from utils.prompt import cache_report
 
 # --- Modelos Pydantic (sem alterações) ---
 class DBCredentials(BaseModel):
@@ -34,155 +42,67 @@ class AgentConfiguration(BaseModel):
 
 class QueryRequest(BaseModel):
     question: str
+    include_data: bool = Field(False, description="Inclui o SQL executado e o resultado em formato colunar na resposta.")
+
+class ResultColumn(BaseModel):
+    name: str
+    type: str
+
+class QueryResult(BaseModel):
+    columns: List[ResultColumn]
+    data: Dict[str, List[Any]]
+    row_count: int
+    truncated: bool = Field(description="True se o resultado tiver mais linhas do que as incluídas; use /results/{result_id} para obter todas.")
 
 class QueryResponse(BaseModel):
     answer: str
+    sql_query: Optional[str] = None
+    result_id: Optional[str] = None
+    data: Optional[QueryResult] = None
 
-# --- Estado Global da Aplicação ---
-app_state: Dict[str, Any] = {}
-SUMMARY_THRESHOLD = 10
+class BatchQueryRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1)
+    concurrency: int = Field(4, ge=1, le=32)
 
-# --- Lógica do Agente ---
+# --- Configuração ---
 load_dotenv()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-CHAT_MODEL = "gpt-4o"
-EMBEDDING_MODEL = "text-embedding-3-small"
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-class SQLQuery(BaseModel):
-    query: str = Field(description="A query SQL completa para ser executada.")
-
-class ValidationDecision(BaseModel):
-    decision: str = Field(description="Responda 'SIM' se a resposta for relevante, 'NÃO' caso contrário.")
-
-class GraphState(TypedDict):
-    question: str
-    tables: str
-    sql_query: str
-    query_result: str
-    final_answer: str
-    error: str
-    retries: int
-    history: List[Dict[str, str]]
-
-# (Nós do Grafo com correções)
-def route_tables_node(state: GraphState, chroma_collection) -> Dict:
-    question = state["question"]
-    results = chroma_collection.query(query_texts=[question], n_results=5) # Aumentado para 5 para mais contexto
-    retrieved_schemas = set(meta['schema'] for meta in results['metadatas'][0])
-    return {"tables": "\n".join(list(retrieved_schemas)), "retries": 0, "error": None}
-
-def generate_sql_node(state: GraphState, dialect: str) -> Dict:
-    print("--- GERANDO SQL ---")
-
-    # Recuperando exemplos (sugestão do ponto 3)
-    # few_shot_examples = buscar_exemplos_do_chroma(state["question"])
-
-    prompt_template = f"""
-    # Tarefa: Gerador de Query SQL
-
-    ## Persona
-    Você é um especialista em SQL, treinado para gerar queries sintaticamente corretas no dialeto **{dialect}**. Sua função é traduzir a pergunta do usuário na query mais precisa possível, usando o schema e as descrições fornecidas como guia semântico.
-
-    ---
-    ## Contexto: Schema do Banco de Dados
-    Abaixo estão os schemas e as descrições das tabelas relevantes para a pergunta.
-
-    {state['tables']}
-
-    ---
-    ## Regras
-    1.  **Fidelidade ao Schema:** Use apenas as tabelas e colunas definidas no contexto.
-    2.  **Relações (JOINs):** Construa `JOINs` corretos com base na lógica das chaves e descrições.
-    3.  **Saída Limpa:** Sua resposta final deve ser apenas o código SQL, através da ferramenta `sql_query`.
-    4.  **NUNCA** esqueça de trazer dados não nulos (ex: `WHERE column IS NOT NULL`).
-    5.  **SEMPRE** coloque as variáveis entre aspas duplas (ex: `WHERE column = "value"`).
-    6.  **Limite de Resultados:** Sempre que possível, limite os resultados.
-
-    ---
-    ## Erro Anterior (se houver)
-    Corrija a query com base neste erro: {state['error']}
-
-    ---
-    ## Pergunta do Usuário
-    "{state['question']}"
-    """
-    
-    # Limpa a mensagem de erro se não houver erro
-    final_prompt = prompt_template.replace("## Erro Anterior (se houver)\nCorrija a query com base neste erro: None\n\n---", "")
+# Estado compartilhado entre workers (configuração, histórico e caches); ver db/state_store.py
+STATE_STORE_URL = os.getenv("AGENT_STATE_STORE", DEFAULT_STATE_STORE)
+# Snapshot da configuração do agente e modo de restauração: "eager" (no startup), "lazy" (na primeira requisição) ou "off"
+SNAPSHOT_PATH = os.getenv("AGENT_SNAPSHOT_PATH", "db/agent_snapshot.json")
+RESTORE_MODE = os.getenv("AGENT_RESTORE_MODE", "lazy").lower()
+# Traces das execuções do grafo (vazio desativa); ver utils/tracing.py e utils/traces.py
+TRACE_PATH = os.getenv("AGENT_TRACE_PATH", "db/traces.db")
+TRACE_MAX_RUNS = int(os.getenv("AGENT_TRACE_MAX_RUNS", "5000"))
+# Intervalo (s) da verificação de mudanças no schema das tabelas configuradas (0 desativa)
+SCHEMA_WATCH_INTERVAL = float(os.getenv("AGENT_SCHEMA_WATCH_INTERVAL", "30"))
+# Última conexão testada na tela de configuração, compartilhada para que `/tables` funcione em qualquer worker
+PENDING_CONNECTION_KEY = "connection:pending"
+PENDING_CONNECTION_TTL = 3600
+# Intervalo (s) da verificação de desconexão do cliente durante uma pergunta; ver utils/cancellation.py
+DISCONNECT_POLL_INTERVAL = float(os.getenv("AGENT_DISCONNECT_POLL_INTERVAL", "0.5"))
 
-    messages = [
-        # O prompt do sistema já está bem detalhado no template
-        *state.get('history', []),
-        {"role": "user", "content": final_prompt}
-    ]
-    
-    response = client.chat.completions.create(
-        model=CHAT_MODEL,
-        messages=messages,
-        tools=[{"type": "function", "function": {"name": "sql_query", "parameters": SQLQuery.model_json_schema()}}],
-        tool_choice={"type": "function", "function": {"name": "sql_query"}}
-    )
-    sql_query = SQLQuery(**json.loads(response.choices[0].message.tool_calls[0].function.arguments)).query
-    return {"sql_query": sql_query, "error": None}
-
-def execute_sql_node(state: GraphState, engine) -> dict:
-    print(f"--- EXECUTANDO SQL (Tentativa {state.get('retries', 0) + 1}) ---")
-    print(f"Query: {state['sql_query']}")
-    if state.get("retries", 0) >= 3: return {"error": "Limite de tentativas atingido."}
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(text(state["sql_query"])).mappings().all()
-        return {"query_result": str(result), "error": None}
-    except SQLAlchemyError as e:
-        # CORREÇÃO: Retorna um erro mais detalhado
-        error_message = f"Erro de banco de dados ao executar a query. Detalhes: {e.orig}"
-        print(f"ERRO SQL: {error_message}")
-        return {"error": error_message, "retries": state.get("retries", 0) + 1}
-
-# CORREÇÃO: Nó de validação mais robusto
-def validate_relevance_node(state: GraphState) -> Dict:
-    print("--- VALIDANDO RELEVÂNCIA ---")
-    # Se o passo anterior deu erro, não há o que validar. Apenas passe o erro adiante.
-    if state.get("error"):
-        return {}
-        
-    system_prompt = "Você é um assistente de validação. Analise a pergunta do usuário, a query SQL executada e o resultado obtido. Sua única tarefa é decidir se o resultado responde adequadamente à pergunta original. Responda estritamente com 'SIM' ou 'NÃO'."
-    user_prompt = f"A pergunta original foi: '{state['question']}'.\nA query SQL executada foi: '{state['sql_query']}'.\nO resultado obtido foi: '{state['query_result']}'.\n\nEste resultado responde à pergunta?"
-    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
-    
-    response = client.chat.completions.create(
-        model=CHAT_MODEL, 
-        messages=messages, 
-        tools=[{"type": "function", "function": {"name": "validation", "parameters": ValidationDecision.model_json_schema()}}], 
-        tool_choice={"type": "function", "function": {"name": "validation"}}
-    )
-    decision = ValidationDecision(**json.loads(response.choices[0].message.tool_calls[0].function.arguments)).decision
-    if decision.upper() == "NÃO":
-        return {"error": "O resultado da query não foi relevante para a pergunta.", "retries": state.get("retries", 0) + 1}
-    return {"error": None}
-
-# CORREÇÃO: Nó de resposta final mais robusto
-def generate_final_answer_node(state: GraphState) -> Dict:
-    print("--- GERANDO RESPOSTA FINAL ---")
-    # Se chegamos aqui com um erro, significa que o limite de tentativas foi atingido.
-    if state.get("error"):
-        return {"final_answer": f"Desculpe, não consegui processar sua pergunta após algumas tentativas. Último erro encontrado: {state['error']}"}
-
-    system_prompt = "Você é um assistente prestativo. Sua tarefa é formular uma resposta clara e concisa em linguagem natural para o usuário, com base na pergunta original e nos dados retornados pela consulta ao banco de dados."
-    user_prompt = f"Pergunta do usuário: '{state['question']}'.\nDados obtidos: '{state['query_result']}'.\n\nFormule a resposta final."
-    messages = [{"role": "system", "content": system_prompt}, *state.get('history', []), {"role": "user", "content": user_prompt}]
-
-    response = client.chat.completions.create(model=CHAT_MODEL, messages=messages)
-    return {"final_answer": response.choices[0].message.content}
-
-def decide_next_node(state: GraphState) -> str:
-    if state.get("error"):
-        if state.get("retries", 0) >= 3:
-            # CORREÇÃO: Se atingir o limite, vá para o nó de resposta final para dar um feedback útil
-            return "Limite de Tentativas Atingido"
-        return "Erro (SQL ou Validação)"
-    return "Sucesso na Validação"
+# --- Estado Global da Aplicação ---
+# `app_state` guarda apenas o que é local ao worker (agente compilado, engine, perfilador)
+app_state: Dict[str, Any] = {}
+state_store = create_state_store(STATE_STORE_URL)
+trace_store = TraceStore(TRACE_PATH, max_runs=TRACE_MAX_RUNS) if TRACE_PATH else None
+SUMMARY_THRESHOLD = 10
+HISTORY_SESSION = "default"
+# Por quanto tempo (s) um resultado pode ser baixado em /results/{result_id}
+RESULT_TTL = 3600
+_restore_lock = threading.Lock()
+# Controle de admissão por tenant/sessão (cabeçalhos X-Tenant-Id e X-Session-Id); ver utils/admission.py
+admission = AdmissionController(
+    requests_per_minute=float(os.getenv("AGENT_RATE_LIMIT_RPM", "30")),
+    tenant_tokens_per_minute=float(os.getenv("AGENT_TENANT_TPM", "200000")),
+    estimated_tokens=int(os.getenv("AGENT_ESTIMATED_TOKENS", "4000")),
+    gate=PriorityGate(
+        max_running=int(os.getenv("AGENT_MAX_CONCURRENT_RUNS", "8")),
+        max_queue=int(os.getenv("AGENT_MAX_QUEUE", "16")),
+        max_wait=float(os.getenv("AGENT_QUEUE_TIMEOUT", "10")),
+    ),
+)
 
 # --- Aplicação FastAPI ---
 # CORREÇÃO: Instanciar o FastAPI apenas uma vez
@@ -199,44 +119,39 @@ origins = [
 ]
 app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
-# (Função de resumo e endpoints / e /tables sem alterações)
-def summarize_conversation(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    history_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-    
-    prompt = f"""
-    Resuma a seguinte conversa entre um usuário e um assistente de forma concisa. 
-    O resumo deve capturar os principais pontos, perguntas e respostas para que o contexto seja mantido em futuras interações, mas de forma muito mais curta.
-
-    Conversa a ser resumida:
-    {history_str}
-    """
-    
-    try:
-        response = client.chat.completions.create(model=CHAT_MODEL, messages=[{"role": "user", "content": prompt}])
-        summary = response.choices[0].message.content
-        return [{"role": "system", "content": f"Resumo da conversa anterior: {summary}"}, *history[-4:]]
-    except Exception as e:
-        print(f"Erro ao resumir: {e}")
-        return history
-
 @app.get("/")
 async def root():
     return {"message": "Text-to-SQL Agent API is running."}
 
+@app.get("/metrics", tags=["Monitoramento"])
+def get_metrics():
+    """
+    Retorna os contadores do processo, as taxas de acerto do cache de prompt e a fração
+    de respostas finais geradas por template (sem LLM).
+    """
+    return {
+        **metrics.snapshot(),
+        **cache_report(),
+        **admission.report(),
+        "answer_fast_path_ratio": metrics.ratio("final_answers_fast_path", "final_answers"),
+    }
+
 @app.get("/tables", response_model=List[TableInfo], tags=["Configuração"])
 def get_configured_tables():
     """
     Retorna a lista de todas as tabelas encontradas no banco de dados após uma conexão bem-sucedida.
     """
     # Verifica se a conexão foi estabelecida no passo anterior
-    if "db_engine" not in app_state:
+    engine = connection_engine()
+    if engine is None:
         raise HTTPException(
             status_code=404, 
             detail="A conexão com o banco de dados ainda não foi estabelecida. Por favor, conecte-se primeiro."
         )
     
     try:
-        engine = app_state["db_engine"]
+        from sqlalchemy import inspect
+
         inspector = inspect(engine)
         table_names = inspector.get_table_names()
 
@@ -245,12 +160,274 @@ def get_configured_tables():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao inspecionar o banco de dados: {str(e)}")
 
+def connection_engine():
+    """
+    Engine da última conexão testada. Com estado compartilhado, o teste pode ter sido feito
+    em outro worker: a conexão é reconstruída a partir da referência gravada no estado.
+    """
+    pending = state_store.cache_get(PENDING_CONNECTION_KEY) if state_store.shared else None
+    if pending is None:
+        return app_state.get("db_engine")
+
+    from db.snapshot import credentials_reference, resolve_credentials
+    from sqlalchemy import create_engine
+
+    local = app_state.get("db_credentials")
+    if local is not None and credentials_reference(local.connection_string) == pending["credentials_ref"]:
+        return app_state["db_engine"]
+    reference, engine = app_state.get("pending_engine", (None, None))
+    if reference != pending["credentials_ref"]:
+        if engine is not None:
+            engine.dispose()
+        engine = create_engine(resolve_credentials(pending["credentials_ref"]))
+        app_state["pending_engine"] = (pending["credentials_ref"], engine)
+    return engine
+
+def replace_profiler(profiler) -> None:
+    """Encerra o perfilador da configuração anterior (se não for reaproveitado) e registra o novo."""
+    if app_state.get("profiler") not in (None, profiler):
+        app_state["profiler"].stop()
+    app_state["profiler"] = profiler
+
+def replace_collection(collection) -> None:
+    """
+    Registra a coleção do Chroma do novo agente. A coleção anterior é mantida por mais uma
+    geração, pois requisições em andamento ainda podem usá-la, e a de antes dela é removida.
+    """
+    import agent_factory
+
+    retired = app_state.get("retired_collection")
+    if retired is not None:
+        agent_factory.drop_collection(retired)
+    app_state["retired_collection"] = app_state.get("chroma_collection")
+    app_state["chroma_collection"] = collection
+
+def replace_schema_watcher(db_engine, table_names: List[str]) -> None:
+    """Encerra a verificação de schema da configuração anterior e inicia a da atual."""
+    from db.schema_watch import SchemaWatcher
+
+    previous = app_state.get("schema_watcher")
+    if previous:
+        previous.stop()
+    if SCHEMA_WATCH_INTERVAL <= 0:
+        return
+    watcher = SchemaWatcher(db_engine, table_names, on_change=partial(reload_schemas, db_engine), interval=SCHEMA_WATCH_INTERVAL)
+    # Mesmo banco (ex: recarga após mudança de schema): parte da última verificação, sem re-refletir tudo
+    if previous is not None and previous.engine is db_engine:
+        watcher.seed(previous)
+    watcher.start()
+    app_state["schema_watcher"] = watcher
+
+def reload_schemas(db_engine, changed_tables: List[str]) -> None:
+    """
+    Chamado pelo SchemaWatcher de `db_engine`: re-reflete apenas as tabelas alteradas e, se o DDL mudou,
+    publica uma nova versão da configuração. Os vetores são reaproveitados (o texto embedado
+    é a descrição da tabela, que não muda com o DDL); só o schema nos metadados é atualizado.
+    O agente novo é compilado em seguida por `ensure_agent` e trocado de uma vez em `app_state`;
+    as requisições em andamento terminam com o agente anterior.
+    """
+    import agent_factory
+    from db.snapshot import fingerprint, write_snapshot
+    from sqlalchemy import inspect
+
+    snapshot = state_store.load_config()
+    # O agente pode ter sido reconfigurado para outro banco depois que a verificação começou
+    if snapshot is None or app_state.get("agent_engine") is not db_engine:
+        return
+    inspector = inspect(db_engine)
+    existing = [name for name in changed_tables if inspector.has_table(name)]
+    reflected = agent_factory.reflect_schemas(db_engine, existing)
+    schemas = dict(snapshot["schemas"])
+    updated = [name for name in changed_tables if reflected.get(name, "") != schemas.get(name, "")]
+    if not updated:
+        return
+
+    print(f"--- SCHEMA ALTERADO: {', '.join(updated)} ---")
+    for name in updated:
+        schemas[name] = reflected.get(name, "")
+    embeddings = dict(snapshot["embeddings"])
+    embeddings["metadatas"] = [
+        {**meta, "schema": schemas[meta["table_name"]]} if meta["table_name"] in updated else meta
+        for meta in embeddings["metadatas"]
+    ]
+    payload = {k: v for k, v in snapshot.items() if k not in ("fingerprint", "created_at")}
+    payload.update(schemas=schemas, embeddings=embeddings)
+    payload["fingerprint"] = fingerprint(payload)
+    payload["created_at"] = time.time()
+
+    # Outro worker (ou um /configure_agent) pode ter publicado uma configuração nesse meio-tempo
+    if state_store.config_version() != snapshot["fingerprint"]:
+        return
+    state_store.save_config(payload)
+    try:
+        write_snapshot(SNAPSHOT_PATH, payload)
+    except Exception as e:
+        print(f"Aviso: não foi possível salvar o snapshot do agente: {e}")
+    metrics.increment("schema_reloads")
+    metrics.increment("schema_reloaded_tables", len(updated))
+    # Compila o novo agente já nesta thread, fora do caminho das requisições
+    ensure_agent()
+
+def restore_agent(snapshot: Dict, source: str) -> bool:
+    """
+    Constrói o agente local a partir de um snapshot (arquivo ou estado compartilhado),
+    sem re-refletir nem re-embedar. Retorna True se o agente estiver pronto ao final.
+    """
+    import agent_factory
+    from db.snapshot import is_compatible, resolve_credentials
+    from sqlalchemy import create_engine
+
+    if not is_compatible(snapshot, agent_factory.EMBEDDING_MODEL):
+        print("Snapshot ignorado: versão ou modelo de embedding incompatível.")
+        return False
+    try:
+        print(f"--- RESTAURANDO AGENTE ({source}) ---")
+        db_credentials = DBCredentials(
+            dialect=snapshot["dialect"],
+            connection_string=resolve_credentials(snapshot["credentials_ref"])
+        )
+        # Mesmo banco (ex: recarga após mudança de schema): o engine e seu pool são reaproveitados
+        # e o perfilador reprocessa apenas as tabelas cujo schema mudou
+        profiler = None
+        if app_state.get("db_credentials") == db_credentials and "db_engine" in app_state:
+            db_engine = app_state["db_engine"]
+            profiler = app_state.get("profiler")
+            if profiler is not None and profiler.engine is not db_engine:
+                profiler = None
+        else:
+            db_engine = create_engine(db_credentials.connection_string)
+        connection = db_engine.connect()
+        connection.close()
+
+        if profiler is not None:
+            previous_schemas = app_state.get("schemas") or {}
+            changed = [name for name, ddl in snapshot["schemas"].items() if previous_schemas.get(name) != ddl]
+            profiler.reset(list(snapshot["schemas"]), changed)
+
+        tables = [TableInfo(**t) for t in snapshot["tables"]]
+        agent, chroma_collection, profiler = agent_factory.build_agent(db_engine, snapshot["dialect"], tables, snapshot["schemas"], embeddings=snapshot["embeddings"], trace_store=trace_store, profiler=profiler)
+        replace_profiler(profiler)
+        replace_collection(chroma_collection)
+
+        app_state["db_engine"] = db_engine
+        app_state["db_credentials"] = db_credentials
+        # Engine do agente: não muda com um simples teste de conexão (que troca `db_engine`)
+        app_state["agent_engine"] = db_engine
+        app_state["tables_info"] = tables
+        app_state["schemas"] = snapshot["schemas"]
+        app_state["config_version"] = snapshot["fingerprint"]
+        app_state["agent_source"] = source
+        app_state["agent"] = agent
+        replace_schema_watcher(db_engine, [t.table_name for t in tables])
+        return True
+    except Exception as e:
+        print(f"Falha ao restaurar o agente: {e}")
+        traceback.print_exc()
+        return False
+
+def restore_agent_from_snapshot() -> bool:
+    """Restaura o agente a partir do snapshot em disco e publica a configuração no estado compartilhado."""
+    if not os.path.exists(SNAPSHOT_PATH):
+        return False
+
+    import agent_factory
+    from db.snapshot import load_snapshot
+
+    snapshot = load_snapshot(SNAPSHOT_PATH, agent_factory.EMBEDDING_MODEL)
+    if snapshot is None or not restore_agent(snapshot, source="snapshot"):
+        return False
+    if state_store.config_version() is None:
+        state_store.save_config(snapshot)
+    return True
+
+def ensure_agent() -> bool:
+    """
+    Garante que este worker tenha um agente compilado para a configuração atual.
+    A versão da configuração compartilhada é consultada a cada chamada; se outro
+    worker reconfigurou o agente, o agente local é reconstruído sob demanda.
+    """
+    shared_version = state_store.config_version()
+    if "agent" in app_state and shared_version in (None, app_state.get("config_version")):
+        return True
+
+    with _restore_lock:
+        # Outra thread pode ter reconstruído o agente enquanto esperávamos o lock
+        shared_version = state_store.config_version()
+        if "agent" in app_state and shared_version in (None, app_state.get("config_version")):
+            return True
+        if shared_version is not None:
+            snapshot = state_store.load_config()
+            if snapshot and restore_agent(snapshot, source="shared"):
+                return True
+        if "agent" in app_state:
+            return True
+        if RESTORE_MODE == "off":
+            return False
+        return restore_agent_from_snapshot()
+
+@app.on_event("startup")
+def restore_on_startup():
+    # No modo eager o agente é restaurado antes de a réplica receber tráfego
+    if RESTORE_MODE == "eager":
+        ensure_agent()
+
+@app.get("/ready", tags=["Monitoramento"])
+def readiness():
+    """
+    Informa se o agente está pronto (aquecido) para responder perguntas.
+    """
+    ready = ensure_agent()
+    status = {
+        "ready": ready,
+        "source": app_state.get("agent_source"),
+        "config_version": app_state.get("config_version"),
+        "restore_mode": RESTORE_MODE,
+        "shared_state": state_store.shared,
+    }
+    if not ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/traces/slowest", tags=["Monitoramento"])
+def slowest_traces(limit: int = Query(20, ge=1, le=200), since_minutes: Optional[float] = Query(None, gt=0)):
+    """
+    Lista as execuções mais lentas registradas (duração, tokens, retries e status).
+    O trace completo de cada uma está em /traces/{run_id}.
+    """
+    if trace_store is None:
+        raise HTTPException(status_code=404, detail="Traces desativados (AGENT_TRACE_PATH vazio).")
+    since = time.time() - since_minutes * 60 if since_minutes else None
+    return trace_store.slowest(limit, since)
+
+@app.get("/traces/{run_id}", tags=["Monitoramento"])
+def get_trace(run_id: str):
+    """
+    Retorna o trace completo de uma execução: tempo por nó, chamadas ao LLM, SQLs candidatos,
+    linhas retornadas e erros.
+    """
+    trace = trace_store.get(run_id) if trace_store is not None else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace não encontrado.")
+    return trace
+
 @app.post("/configure_agent", status_code=200)
 def configure_agent(config: AgentConfiguration):
     """
     Configura o agente. Se a lista de tabelas estiver vazia, apenas testa a conexão.
     Se a lista de tabelas estiver preenchida, configura o agente completo.
     """
+    import agent_factory
+    from db.snapshot import DB_PASSWORD_ENV, build_snapshot, credentials_reference, is_restorable, write_snapshot
+    from sqlalchemy import create_engine
+
+    # A senha nunca é gravada no estado compartilhado: os demais workers a leem do ambiente
+    if state_store.shared and not is_restorable(config.db_credentials.connection_string):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Com vários workers, a senha do banco deve estar na variável de ambiente {DB_PASSWORD_ENV} "
+                   "(e ser a mesma informada), e a string de conexão não pode ter outros segredos."
+        )
+
     try:
         # Passo 1: Sempre criar o engine para testar a conexão
         db_engine = create_engine(config.db_credentials.connection_string)
@@ -262,7 +439,10 @@ def configure_agent(config: AgentConfiguration):
         app_state["db_engine"] = db_engine
         app_state["db_credentials"] = config.db_credentials
         app_state["tables_info"] = config.tables
-        app_state["conversation_history"] = []
+        state_store.set_history(HISTORY_SESSION, [])
+        state_store.cache_set(PENDING_CONNECTION_KEY, {"dialect": config.db_credentials.dialect,
+                                                       "credentials_ref": credentials_reference(config.db_credentials.connection_string)},
+                              ttl=PENDING_CONNECTION_TTL)
 
         # Passo 2: VERIFICAR se é apenas um teste de conexão
         # Se a lista de tabelas enviada estiver vazia, paramos por aqui.
@@ -272,51 +452,32 @@ def configure_agent(config: AgentConfiguration):
 
         # Passo 3: Se a lista de tabelas NÃO estiver vazia, continue com a configuração completa
         print("--- CONFIGURAÇÃO FINAL DO AGENTE ---")
-        inspector = inspect(db_engine)
-        table_names = [t.table_name for t in config.tables]
-        schemas = {
-            name: f"CREATE TABLE {name} (\n" + ",\n".join([f"  {col['name']} {str(col['type'])}" for col in inspector.get_columns(name)]) + "\n);"
-            for name in table_names if inspector.get_columns(name)
-        }
-
-        chroma_client = chromadb.Client()
-        embedding_func = embedding_functions.OpenAIEmbeddingFunction(api_key=OPENAI_API_KEY, model_name=EMBEDDING_MODEL)
-        chroma_collection = chroma_client.get_or_create_collection(name="dynamic_db_agent_memory", embedding_function=embedding_func)
-        
-        ids = [f"{t.table_name}_doc" for t in config.tables]
-        if chroma_collection.count() > 0:
-            existing_ids = chroma_collection.get(ids=ids)['ids']
-            if existing_ids:
-                chroma_collection.delete(ids=existing_ids)
-        
-        # Agora, esta chamada nunca terá listas vazias
-        chroma_collection.add(
-            documents=[t.description for t in config.tables],
-            metadatas=[{"table_name": t.table_name, "schema": schemas.get(t.table_name, "")} for t in config.tables],
-            ids=ids
+        schemas = agent_factory.reflect_schemas(db_engine, [t.table_name for t in config.tables])
+        agent, chroma_collection, profiler = agent_factory.build_agent(db_engine, config.db_credentials.dialect, config.tables, schemas, trace_store=trace_store)
+        replace_profiler(profiler)
+        snapshot = build_snapshot(
+            dialect=config.db_credentials.dialect,
+            connection_string=config.db_credentials.connection_string,
+            tables=[t.model_dump() for t in config.tables],
+            schemas=schemas,
+            collection=chroma_collection,
+            embedding_model=agent_factory.EMBEDDING_MODEL
         )
-        
-        workflow = StateGraph(GraphState)
-        # ... (adição de nós e arestas do workflow sem alterações)
-        workflow.add_node("route_tables", partial(route_tables_node, chroma_collection=chroma_collection))
-        workflow.add_node("generate_sql", partial(generate_sql_node, dialect=config.db_credentials.dialect))
-        workflow.add_node("execute_sql", partial(execute_sql_node, engine=db_engine))
-        workflow.add_node("validate_relevance", validate_relevance_node)
-        workflow.add_node("generate_final_answer", generate_final_answer_node)
-
-        workflow.set_entry_point("route_tables")
-        workflow.add_edge("route_tables", "generate_sql")
-        workflow.add_edge("generate_sql", "execute_sql")
-        workflow.add_edge("execute_sql", "validate_relevance")
-        
-        workflow.add_conditional_edges("validate_relevance", decide_next_node, {
-            "Erro (SQL ou Validação)": "generate_sql",
-            "Sucesso na Validação": "generate_final_answer",
-            "Limite de Tentativas Atingido": "generate_final_answer"
-        })
-        workflow.add_edge("generate_final_answer", END)
-        
-        app_state["agent"] = workflow.compile()
+        replace_collection(chroma_collection)
+        app_state["agent"] = agent
+        app_state["agent_source"] = "configure"
+        app_state["agent_engine"] = db_engine
+        app_state["schemas"] = schemas
+        app_state["config_version"] = snapshot["fingerprint"]
+        replace_schema_watcher(db_engine, [t.table_name for t in config.tables])
+
+        # Passo 4: Publica a configuração para os demais workers e persiste o snapshot
+        # para que reinícios e novas réplicas já subam configurados
+        state_store.save_config(snapshot)
+        try:
+            write_snapshot(SNAPSHOT_PATH, snapshot)
+        except Exception as e:
+            print(f"Aviso: não foi possível salvar o snapshot do agente: {e}")
         
         return {"message": "Agente configurado com sucesso."}
         
@@ -325,21 +486,62 @@ def configure_agent(config: AgentConfiguration):
         raise HTTPException(status_code=500, detail=f"Falha ao configurar o agente: {str(e)}")
 
 
-@app.post("/query", response_model=QueryResponse, tags=["Chat"])
-def query_agent(request: QueryRequest):
-    if "agent" not in app_state:
+def caller_identity(http_request: Request, tenant: Optional[str], session: Optional[str]):
+    """Tenant e sessão da requisição; sem cabeçalhos, o tenant é "default" e a sessão é o IP do cliente."""
+    client = http_request.client.host if http_request.client else "anonymous"
+    return tenant or "default", session or client
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+@app.post("/query", response_model=QueryResponse, response_model_exclude_none=True, tags=["Chat"])
+async def query_agent(request: QueryRequest, http_request: Request,
+                      x_tenant_id: Optional[str] = Header(None), x_session_id: Optional[str] = Header(None)):
+    """
+    Responde uma pergunta. A execução roda em uma thread enquanto a conexão é monitorada:
+    se o cliente desconectar, o grafo para no próximo nó, a chamada ao LLM em andamento é
+    abandonada e o statement em execução é cancelado no banco.
+    """
+    tenant, session = caller_identity(http_request, x_tenant_id, x_session_id)
+    token = CancelToken()
+
+    def answer():
+        with bind(token):
+            return answer_question(request, tenant, session)
+
+    work = asyncio.ensure_future(run_in_threadpool(answer))
+    try:
+        while not work.done():
+            await asyncio.wait({work}, timeout=DISCONNECT_POLL_INTERVAL)
+            if not work.done() and await http_request.is_disconnected():
+                metrics.increment("requests_abandoned")
+                token.cancel("o cliente desconectou")
+                break
+        return await work
+    finally:
+        # Requisição interrompida pelo servidor (ex: shutdown): a execução também é cancelada
+        if not work.done():
+            token.cancel("requisição interrompida")
+
+def answer_question(request: QueryRequest, tenant: str, session: str) -> QueryResponse:
+    if not ensure_agent():
         raise HTTPException(status_code=400, detail="Agente não configurado.")
     
-    try:
-        history = app_state.get("conversation_history", [])
-        if len(history) >= SUMMARY_THRESHOLD:
-            history = summarize_conversation(history)
-            app_state["conversation_history"] = history
+    import agent_factory
 
-        agent = app_state["agent"]
-        initial_state = {"question": request.question, "history": history}
-        
-        final_state = agent.invoke(initial_state, {"recursion_limit": 15})
+    start = time.perf_counter()
+    try:
+        # Rejeita na hora (429) quem excede os limites, antes de qualquer chamada ao LLM
+        with admission.admit(tenant, session, request.question):
+            history = state_store.get_history(HISTORY_SESSION)
+            if len(history) >= SUMMARY_THRESHOLD:
+                history = agent_factory.summarize_conversation(history)
+                state_store.set_history(HISTORY_SESSION, history)
+
+            agent = app_state["agent"]
+            initial_state = {"question": request.question, "history": history, "deadline": time.time() + agent_factory.REQUEST_DEADLINE}
+            
+            final_state = agent.invoke(initial_state, {"recursion_limit": 15})
         
         # Este IF agora se torna um fallback, pois o grafo deve sempre terminar em 'generate_final_answer'
         if not final_state.get('final_answer') and final_state.get('error'):
@@ -349,9 +551,29 @@ def query_agent(request: QueryRequest):
         
         history.append({"role": "user", "content": request.question})
         history.append({"role": "assistant", "content": answer})
-        app_state["conversation_history"] = history
+        state_store.set_history(HISTORY_SESSION, history)
         
-        return QueryResponse(answer=answer)
+        if not request.include_data or final_state.get('error') or not final_state.get('query_data'):
+            return QueryResponse(answer=answer)
+
+        # O SQL fica registrado no estado compartilhado para o download sem reexecutar o pipeline do LLM
+        result_id = uuid.uuid4().hex
+        state_store.cache_set(f"result:{result_id}", {"sql_query": final_state['sql_query'], "config_version": app_state.get("config_version")}, ttl=RESULT_TTL)
+        return QueryResponse(answer=answer, sql_query=final_state['sql_query'], result_id=result_id, data=final_state['query_data'])
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    except RunCancelledError:
+        metrics.increment("runs_cancelled")
+        metrics.increment("cancelled_run_seconds", time.perf_counter() - start)
+        # 499: convenção (nginx) para requisição encerrada pelo cliente; a resposta não chega a ser lida
+        raise HTTPException(status_code=499, detail="Requisição cancelada pelo cliente.")
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=504, detail=f"Tempo limite da requisição esgotado: {e}")
+    except LLMUnavailableError as e:
+        # Falha transitória do provedor: o cliente pode tentar novamente em instantes
+        raise HTTPException(status_code=503, detail=f"O modelo de linguagem está indisponível no momento: {e}", headers={"Retry-After": "30"})
     except Exception as e:
         # CORREÇÃO: Print muito mais detalhado para depuração
         print("--- ERRO INESPERADO NO ENDPOINT /query ---")
@@ -360,5 +582,82 @@ def query_agent(request: QueryRequest):
         traceback.print_exc() # Imprime o stack trace completo
         raise HTTPException(status_code=500, detail=f"Erro crítico durante a execução da query: {str(e)}")
 
+@app.post("/query/batch", tags=["Chat"])
+def query_agent_batch(request: BatchQueryRequest, http_request: Request,
+                      x_tenant_id: Optional[str] = Header(None), x_session_id: Optional[str] = Header(None)):
+    """
+    Responde uma lista de perguntas (ex: relatórios noturnos), transmitindo os resultados
+    como NDJSON, uma linha por pergunta com `index`, `status`, `answer`, `sql_query` e `error`.
+    O histórico da conversa não é usado nem alterado. As execuções têm prioridade menor
+    que as perguntas interativas na fila de admissão.
+    """
+    if not ensure_agent():
+        raise HTTPException(status_code=400, detail="Agente não configurado.")
+
+    import agent_factory
+
+    agent, chroma_collection = app_state["agent"], app_state["chroma_collection"]
+    tenant, session = caller_identity(http_request, x_tenant_id, x_session_id)
+    try:
+        # Aqui só conta a requisição da sessão: os tokens são reservados por pergunta, ao executar
+        admission.reserve(tenant, session, [])
+    except AdmissionRejected as e:
+        raise admission_error(e)
+
+    # Um batch não ocupa mais slots do que o portão de execução oferece
+    concurrency = min(request.concurrency, admission.gate.max_running)
+    run_slot = lambda question: admission.batch_run(tenant, question, max_wait=agent_factory.REQUEST_DEADLINE)
+
+    def stream():
+        try:
+            for item in agent_factory.run_batch(agent, chroma_collection, request.questions, concurrency, run_slot=run_slot):
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        except Exception as e:
+            traceback.print_exc()
+            yield json.dumps({"index": None, "status": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+RESULT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson_stream"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow_stream"),
+    "parquet": ("application/vnd.apache.parquet", "parquet_stream"),
+}
+
+@app.get("/results/{result_id}", tags=["Chat"])
+def download_result(result_id: str, format: str = "json", offset: int = Query(0, ge=0), limit: int = Query(1000, ge=1, le=50000)):
+    """
+    Baixa o resultado completo de uma pergunta feita com `include_data=true`, reexecutando
+    apenas o SQL (sem o pipeline do LLM) e transmitindo as linhas direto do banco.
+    `format=json` devolve uma página colunar (`offset`/`limit`); `ndjson`, `arrow` (Arrow IPC)
+    e `parquet` devolvem o resultado inteiro em streaming.
+    """
+    entry = state_store.cache_get(f"result:{result_id}")
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Resultado não encontrado ou expirado.")
+    if not ensure_agent() or entry["config_version"] != app_state.get("config_version"):
+        raise HTTPException(status_code=409, detail="A configuração do agente mudou desde que o resultado foi gerado.")
+    if format != "json" and format not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato inválido. Opções: json, {', '.join(RESULT_FORMATS)}.")
+
+    from utils import results
+
+    # O engine do agente que gerou o resultado, não o da última conexão testada
+    engine, sql_query = app_state["agent_engine"], entry["sql_query"]
+    if format == "json":
+        return results.fetch_page(engine, sql_query, offset, limit)
+
+    if format in ("arrow", "parquet") and importlib.util.find_spec("pyarrow") is None:
+        raise HTTPException(status_code=501, detail="Exportação Arrow/Parquet requer o pacote opcional 'pyarrow'.")
+
+    media_type, stream_name = RESULT_FORMATS[format]
+    headers = {"Content-Disposition": f'attachment; filename="{result_id}.{format}"'}
+    return StreamingResponse(getattr(results, stream_name)(engine, sql_query), media_type=media_type, headers=headers)
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    import uvicorn
+
+    workers = int(os.getenv("API_WORKERS", "1"))
+    if workers > 1 and not state_store.shared:
+        raise SystemExit("Com API_WORKERS > 1 configure um estado compartilhado, ex: AGENT_STATE_STORE=sqlite:///db/shared_state.db")
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
\ No newline at end of file
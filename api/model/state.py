@@ -1,6 +1,6 @@
 """Estado do gráfico para rastrear o progresso."""
 
-from typing import TypedDict
+from typing import Any, Dict, List, TypedDict
 
 class GraphState(TypedDict):
     """Estado do gráfico para rastrear o progresso."""
@@ -8,6 +8,11 @@ class GraphState(TypedDict):
     tables: str
     sql_query: str
     query_result: str
+    query_data: Dict[str, Any]
     final_answer: str
     error: str
     retries: int
+    history: List[Dict[str, str]]
+    # Cache de resultados compartilhado pelas perguntas de um mesmo batch (ver run_batch)
+    result_cache: Any
+    deadline: float
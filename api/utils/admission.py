@@ -0,0 +1,284 @@
+"""Controle de admissão das execuções do grafo.
+
+Cada pergunta passa por três verificações antes de chegar ao LLM:
+
+    limite de requisições por sessão (token bucket)
+    orçamento de tokens do LLM por tenant (token bucket de TPM, com a estimativa da execução)
+    slot de execução (concorrência limitada, fila por prioridade e tempo máximo de espera)
+
+O que não cabe é rejeitado na hora com `AdmissionRejected`, que informa em quantos
+segundos vale tentar de novo. Ao final, a estimativa é acertada com os tokens
+realmente consumidos (ver `track_usage` em utils/prompt.py).
+
+As perguntas de um batch reservam tokens uma a uma, quando vão executar: esperam o
+orçamento do tenant em vez de serem rejeitadas e nunca consomem a parcela reservada às
+perguntas interativas (BATCH_TOKEN_HEADROOM).
+
+Os limites são locais ao processo: com vários workers, cada um aplica os seus.
+"""
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, Tuple
+
+from utils import cancellation, metrics
+from utils.prompt import RequestUsage, track_usage
+
+# Prioridades da fila (menor é atendido primeiro)
+INTERACTIVE = 0
+BATCH = 1
+# Fração do orçamento de tokens do tenant que as perguntas de batch deixam livre para as interativas
+BATCH_TOKEN_HEADROOM = 0.25
+
+
+class AdmissionRejected(Exception):
+    """A requisição excede um limite; `retry_after` é o tempo sugerido (s) para nova tentativa."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """Balde com `capacity` fichas reabastecido a `rate` fichas/s. Não é thread-safe (ver AdmissionController)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos até haver `amount` fichas (0 se já houver). Pedidos maiores que a capacidade esperam o balde cheio."""
+        self._refill()
+        missing = min(amount, self.capacity) - self._tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def adjust(self, amount: float) -> None:
+        """Retira (negativo) ou devolve (positivo) fichas; o saldo pode ficar negativo após um consumo acima do estimado."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class PriorityGate:
+    """Limita as execuções simultâneas; quem espera é atendido por prioridade e, em empate, por ordem de chegada."""
+
+    def __init__(self, max_running: int = 8, max_queue: int = 16, max_wait: float = 10.0):
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.running = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        # Média móvel da duração das execuções, usada para estimar o Retry-After
+        self._avg_duration = 5.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def _retry_after(self) -> float:
+        return self._avg_duration * (len(self._queue) + 1) / self.max_running
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def _leave_queue(self, entry) -> None:
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._cond.notify_all()
+
+    def _acquire(self, priority: int, max_wait: float) -> None:
+        # Execução cancelada (ex: o cliente desconectou) sai da fila na hora, sem esperar o timeout
+        token = cancellation.current()
+        with self._cond:
+            if self.running < self.max_running and not self._queue:
+                self.running += 1
+                return
+            if len(self._queue) >= self.max_queue:
+                metrics.increment("admission_rejected_queue_full")
+                raise AdmissionRejected("Fila de execução cheia.", self._retry_after())
+
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._queue, entry)
+            start = time.monotonic()
+            try:
+                with token.on_cancel(self._wake) if token is not None else nullcontext():
+                    while not (self._queue[0] == entry and self.running < self.max_running):
+                        if token is not None and token.cancelled:
+                            self._leave_queue(entry)
+                            metrics.increment("admission_cancelled_in_queue")
+                            token.raise_if_cancelled()
+                        remaining = start + max_wait - time.monotonic()
+                        if remaining <= 0:
+                            self._leave_queue(entry)
+                            metrics.increment("admission_rejected_queue_timeout")
+                            raise AdmissionRejected("Tempo máximo de espera na fila excedido.", self._retry_after())
+                        self._cond.wait(remaining)
+                heapq.heappop(self._queue)
+                self.running += 1
+                self._cond.notify_all()
+            finally:
+                metrics.increment("admission_queue_wait_seconds", time.monotonic() - start)
+
+    @contextmanager
+    def slot(self, priority: int = INTERACTIVE, max_wait: float = None) -> Iterator[None]:
+        self._acquire(priority, self.max_wait if max_wait is None else max_wait)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.running -= 1
+                self._avg_duration = 0.9 * self._avg_duration + 0.1 * (time.monotonic() - start)
+                self._cond.notify_all()
+
+
+class Reservation:
+    """Tokens reservados para uma requisição; `settle` acerta o orçamento do tenant com o consumo real."""
+
+    def __init__(self, controller: "AdmissionController", tenant: str, estimated_tokens: int, runs: int):
+        self._controller = controller
+        self.tenant = tenant
+        self.estimated_tokens = estimated_tokens
+        self.runs = runs
+        self._settled = False
+
+    def settle(self, actual_tokens: int) -> None:
+        if self._settled:
+            return
+        self._settled = True
+        self._controller._settle(self, actual_tokens)
+
+
+class AdmissionController:
+    """Limites de requisições por sessão e de tokens por tenant, mais o portão de execuções simultâneas."""
+
+    def __init__(self, requests_per_minute: float = 30, tenant_tokens_per_minute: float = 200_000,
+                 estimated_tokens: int = 4000, gate: PriorityGate = None):
+        self.requests_per_minute = requests_per_minute
+        self.tenant_tokens_per_minute = tenant_tokens_per_minute
+        self.gate = gate or PriorityGate()
+        # Tokens por execução do grafo: começa no valor configurado e acompanha o consumo real
+        self._tokens_per_run = float(estimated_tokens)
+        self._sessions: Dict[Tuple[str, str], TokenBucket] = {}
+        self._tenants: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def estimate(self, questions) -> int:
+        """Estimativa de tokens para responder as perguntas (média por execução + o texto de cada pergunta)."""
+        return int(sum(self._tokens_per_run + len(question) / 4 for question in questions))
+
+    def _bucket(self, buckets: Dict, key, per_minute: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            # Remove baldes cheios (clientes inativos) para a tabela não crescer sem limite
+            if len(buckets) >= 10_000:
+                for idle_key in [k for k, b in buckets.items() if b.idle]:
+                    del buckets[idle_key]
+            bucket = buckets[key] = TokenBucket(per_minute / 60, per_minute)
+        return bucket
+
+    def reserve(self, tenant: str, session: str, questions) -> Reservation:
+        """Consome uma requisição da sessão e a estimativa de tokens do tenant, ou rejeita sem consumir nada."""
+        estimated = self.estimate(questions)
+        with self._lock:
+            requests = self._bucket(self._sessions, (tenant, session), self.requests_per_minute)
+            tokens = self._bucket(self._tenants, tenant, self.tenant_tokens_per_minute)
+            wait = requests.wait_time(1)
+            if wait:
+                metrics.increment("admission_rejected_rate")
+                raise AdmissionRejected("Limite de requisições da sessão excedido.", wait)
+            wait = tokens.wait_time(estimated)
+            if wait:
+                metrics.increment("admission_rejected_tokens")
+                raise AdmissionRejected("Orçamento de tokens do tenant esgotado.", wait)
+            requests.adjust(-1)
+            tokens.adjust(-estimated)
+        metrics.increment("admission_estimated_tokens", estimated)
+        return Reservation(self, tenant, estimated, len(questions))
+
+    def _settle(self, reservation: Reservation, actual_tokens: int) -> None:
+        with self._lock:
+            self._bucket(self._tenants, reservation.tenant, self.tenant_tokens_per_minute).adjust(reservation.estimated_tokens - actual_tokens)
+            if actual_tokens and reservation.runs:
+                self._tokens_per_run = 0.8 * self._tokens_per_run + 0.2 * actual_tokens / reservation.runs
+        metrics.increment("admission_actual_tokens", actual_tokens)
+
+    @contextmanager
+    def slot(self, usage: RequestUsage, priority: int = BATCH, max_wait: float = None) -> Iterator[None]:
+        """Slot de execução que soma em `usage` os tokens consumidos na thread atual."""
+        with self.gate.slot(priority, max_wait), track_usage(usage):
+            metrics.increment("admission_admitted")
+            yield
+
+    @contextmanager
+    def batch_run(self, tenant: str, question: str, max_wait: float = None) -> Iterator[None]:
+        """
+        Admite uma pergunta de um batch: espera até `max_wait` segundos pelo orçamento de tokens
+        do tenant (sem ocupar a parcela das perguntas interativas) e por um slot BATCH, e acerta
+        os tokens dessa pergunta ao final.
+        """
+        deadline = time.monotonic() + (self.gate.max_wait if max_wait is None else max_wait)
+        estimated = self.estimate([question])
+        while True:
+            with self._lock:
+                tokens = self._bucket(self._tenants, tenant, self.tenant_tokens_per_minute)
+                wait = tokens.wait_time(estimated + BATCH_TOKEN_HEADROOM * tokens.capacity)
+                if not wait:
+                    tokens.adjust(-estimated)
+                    break
+            if time.monotonic() + wait > deadline:
+                metrics.increment("admission_rejected_tokens")
+                raise AdmissionRejected("Orçamento de tokens do tenant esgotado.", wait)
+            metrics.increment("admission_batch_token_wait_seconds", wait)
+            token = cancellation.current()
+            if token is None:
+                time.sleep(wait)
+            elif token.wait(wait):
+                token.raise_if_cancelled()
+        metrics.increment("admission_estimated_tokens", estimated)
+
+        reservation = Reservation(self, tenant, estimated, 1)
+        usage = RequestUsage()
+        try:
+            with self.slot(usage, BATCH, max(deadline - time.monotonic(), 0)):
+                yield
+        finally:
+            reservation.settle(usage.total)
+
+    @contextmanager
+    def admit(self, tenant: str, session: str, question: str, priority: int = INTERACTIVE) -> Iterator[Reservation]:
+        """Admite uma execução do grafo: reserva, aguarda um slot e acerta os tokens ao final."""
+        reservation = self.reserve(tenant, session, [question])
+        usage = RequestUsage()
+        try:
+            with self.slot(usage, priority):
+                yield reservation
+        finally:
+            reservation.settle(usage.total)
+
+    def report(self) -> Dict[str, float]:
+        """Situação atual do portão de execução, para /metrics."""
+        return {
+            "admission_running": self.gate.running,
+            "admission_queued": self.gate.queued,
+            "admission_tokens_per_run": round(self._tokens_per_run, 1),
+        }
@@ -0,0 +1,115 @@
+"""Respostas por template para resultados simples, evitando a chamada ao LLM em generate_final_answer_node.
+
+Formatos reconhecidos (sobre o payload colunar de utils/results.py):
+    escalar         1 linha x 1 coluna
+    linha única     1 linha x até MAX_SINGLE_ROW_COLUMNS colunas
+    lista curta     até MAX_LIST_ROWS linhas x até MAX_LIST_COLUMNS colunas
+Qualquer outro formato, ou colunas sem um nome simples (ex: `COUNT(*)` sem alias), retorna
+None e a resposta é gerada pelo LLM.
+"""
+
+import datetime
+import decimal
+import re
+from typing import Any, Dict, Optional
+
+MAX_SINGLE_ROW_COLUMNS = 4
+MAX_LIST_ROWS = 5
+MAX_LIST_COLUMNS = 3
+# Inteiros abaixo disso não recebem separador de milhar (ex: 2024, não 2.024)
+MIN_GROUPED_INTEGER = 10_000
+
+# Nome de coluna que vira rótulo: identificador simples (letras, dígitos e _)
+_PLAIN_IDENTIFIER = re.compile(r"[^\W\d]\w*")
+# Colunas de identificadores, anos e códigos: os inteiros são mostrados como estão
+_IDENTIFIER_COLUMN = re.compile(
+    r"(^|_)(id|ids|ano|anos|year|years|año|codigo|código|cod|code|cep|zip|numero|número|number|nro|num)(_|$)"
+)
+
+_STOPWORDS = {
+    "pt": {"o", "a", "os", "as", "de", "do", "da", "dos", "das", "que", "qual", "quais", "quem", "quanto",
+           "quantos", "quantas", "em", "no", "na", "mais", "por", "com", "para", "foi", "um", "uma", "é"},
+    "en": {"the", "what", "which", "who", "how", "many", "much", "is", "are", "was", "of", "in", "did",
+           "most", "top", "by", "for", "with", "a", "an", "does"},
+    "es": {"el", "la", "los", "las", "cuál", "cuáles", "quién", "cuánto", "cuántos", "de", "del", "que",
+           "en", "más", "por", "con", "para", "es", "fue", "un", "una"},
+}
+
+_TEMPLATES = {
+    "pt": {"scalar": "{label}: {value}.", "row": "Resultado encontrado: {fields}.",
+           "list": "Resultados encontrados ({header}):\n{items}", "empty": "Não encontrei nenhum resultado para essa pergunta."},
+    "en": {"scalar": "{label}: {value}.", "row": "Result found: {fields}.",
+           "list": "Results found ({header}):\n{items}", "empty": "I couldn't find any results for that question."},
+    "es": {"scalar": "{label}: {value}.", "row": "Resultado encontrado: {fields}.",
+           "list": "Resultados encontrados ({header}):\n{items}", "empty": "No encontré resultados para esa pregunta."},
+}
+
+
+def detect_language(question: str) -> str:
+    """Detecta o idioma da pergunta (pt, en ou es) por palavras funcionais; em empate, pt."""
+    words = re.findall(r"\w+", question.lower())
+    scores = {lang: sum(word in stopwords for word in words) for lang, stopwords in _STOPWORDS.items()}
+    best = max(scores, key=lambda lang: (scores[lang], lang == "pt"))
+    return best if scores[best] else "pt"
+
+
+def format_value(value: Any, language: str, column: str = "") -> str:
+    """
+    Formata números e datas no padrão do idioma (ex: 10.000,90 em pt/es e 10,000.90 em en).
+    Inteiros só recebem separador de milhar a partir de MIN_GROUPED_INTEGER e fora de colunas
+    de identificadores, anos e códigos.
+    """
+    if value is None:
+        return "-"
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, (float, decimal.Decimal)) and float(value).is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        if abs(value) < MIN_GROUPED_INTEGER or _IDENTIFIER_COLUMN.search(column.lower()):
+            return str(value)
+        text = f"{value:,}"
+    elif isinstance(value, (float, decimal.Decimal)):
+        text = f"{value:,.2f}"
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%m/%d/%Y" if language == "en" else "%d/%m/%Y")
+    else:
+        return str(value)
+    if language == "en":
+        return text
+    return text.replace(",", "_").replace(".", ",").replace("_", ".")
+
+
+def humanize(column: str) -> str:
+    """Transforma o nome da coluna em um rótulo legível (total_gasto -> Total gasto)."""
+    label = column.replace("_", " ").strip()
+    return label[:1].upper() + label[1:]
+
+
+def render_simple_answer(question: str, query_data: Optional[Dict]) -> Optional[str]:
+    """Retorna a resposta por template, ou None se o formato do resultado exigir o LLM."""
+    if not query_data or query_data.get("truncated"):
+        return None
+    columns = [c["name"] for c in query_data["columns"]]
+    # Expressões sem alias (ex: COUNT(*)) não viram rótulo: o LLM descreve o resultado
+    if not all(_PLAIN_IDENTIFIER.fullmatch(c) for c in columns):
+        return None
+    data = query_data["data"]
+    row_count = query_data["row_count"]
+    language = detect_language(question)
+    templates = _TEMPLATES[language]
+
+    if row_count == 0:
+        return templates["empty"]
+    if row_count == 1 and len(columns) == 1:
+        return templates["scalar"].format(label=humanize(columns[0]), value=format_value(data[columns[0]][0], language, columns[0]))
+    if row_count == 1 and len(columns) <= MAX_SINGLE_ROW_COLUMNS:
+        fields = ", ".join(f"{humanize(c)}: {format_value(data[c][0], language, c)}" for c in columns)
+        return templates["row"].format(fields=fields)
+    if row_count <= MAX_LIST_ROWS and len(columns) <= MAX_LIST_COLUMNS:
+        items = "\n".join(
+            f"{i + 1}. " + " — ".join(format_value(data[c][i], language, c) for c in columns)
+            for i in range(row_count)
+        )
+        return templates["list"].format(header=" — ".join(humanize(c) for c in columns), items=items)
+    return None
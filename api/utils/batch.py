@@ -0,0 +1,64 @@
+"""Execução em lote de perguntas pela linha de comando (ex: relatórios noturnos).
+
+Uso (a partir da pasta api/, com um agente já configurado ao menos uma vez pela API):
+    python -m utils.batch perguntas.txt --concurrency 8 > respostas.ndjson
+
+As perguntas são lidas uma por linha (do arquivo ou da entrada padrão) e o agente
+é restaurado a partir do snapshot gravado por /configure_agent. Cada resultado é
+escrito como uma linha NDJSON na saída padrão.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from sqlalchemy import create_engine
+
+import agent_factory
+from db.snapshot import load_snapshot, resolve_credentials
+from utils.colors import Colors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", nargs="?", help="Arquivo com uma pergunta por linha (padrão: entrada padrão)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--snapshot", default=os.getenv("AGENT_SNAPSHOT_PATH", "db/agent_snapshot.json"))
+    args = parser.parse_args()
+
+    source = open(args.questions, encoding="utf-8") if args.questions else sys.stdin
+    with source:
+        questions = [line.strip() for line in source if line.strip()]
+    if not questions:
+        print(f"{Colors.RED}Nenhuma pergunta informada.{Colors.ENDC}", file=sys.stderr)
+        return 1
+
+    snapshot = load_snapshot(args.snapshot, agent_factory.EMBEDDING_MODEL)
+    if snapshot is None:
+        print(f"{Colors.RED}Snapshot não encontrado em '{args.snapshot}'. Configure o agente pela API primeiro.{Colors.ENDC}", file=sys.stderr)
+        return 1
+
+    db_engine = create_engine(resolve_credentials(snapshot["credentials_ref"]))
+    tables = [argparse.Namespace(**t) for t in snapshot["tables"]]
+    agent, chroma_collection, profiler = agent_factory.build_agent(
+        db_engine, snapshot["dialect"], tables, snapshot["schemas"], embeddings=snapshot["embeddings"]
+    )
+
+    print(f"{Colors.BOLD}Executando {len(questions)} perguntas (concorrência {args.concurrency}){Colors.ENDC}", file=sys.stderr)
+    failures = 0
+    try:
+        for item in agent_factory.run_batch(agent, chroma_collection, questions, args.concurrency):
+            failures += item["status"] != "ok"
+            print(json.dumps(item, ensure_ascii=False), flush=True)
+    finally:
+        profiler.stop()
+        db_engine.dispose()
+
+    color = Colors.GREEN if not failures else Colors.YELLOW
+    print(f"{color}Concluído: {len(questions) - failures} ok, {failures} com erro.{Colors.ENDC}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
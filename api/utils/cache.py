@@ -0,0 +1,56 @@
+"""Cache em memória com TTL e deduplicação de chamadas concorrentes (single-flight)."""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable
+
+
+class SingleFlightCache:
+    """Cache com TTL em que chamadas concorrentes para a mesma chave compartilham um único cálculo.
+
+    Erros não são cacheados: são repassados a todos que esperavam pelo cálculo.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, tuple] = {}
+        self._inflight: Dict[Hashable, dict] = {}
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "value": None, "error": None}
+                self._inflight[key] = call
+
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["value"]
+
+        try:
+            call["value"] = compute()
+            with self._lock:
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[key] = (time.monotonic() + self.ttl, call["value"])
+            return call["value"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call["event"].set()
+
+    def clear(self) -> None:
+        """Descarta os valores cacheados (cálculos em andamento não são afetados)."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,101 @@
+"""Cancelamento cooperativo das execuções do grafo (ex: o cliente fechou a conexão).
+
+O token da execução atual fica em uma ContextVar, como o trace (ver utils/tracing.py).
+O grafo verifica o token entre um nó e outro; quem está bloqueado em I/O registra um
+callback com `on_cancel` para ser interrompido na hora (chamada ao LLM, statement no banco).
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional
+
+_current: ContextVar[Optional["CancelToken"]] = ContextVar("cancel_token", default=None)
+
+
+class RunCancelledError(Exception):
+    """A execução foi cancelada (ex: o cliente desconectou) e o trabalho restante foi abandonado."""
+
+
+class CancelToken:
+    """Sinal de cancelamento de uma execução, compartilhado entre as threads que trabalham nela."""
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._callbacks = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelado") -> None:
+        """Marca o token como cancelado e dispara os callbacks registrados (uma única vez)."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Erro ao cancelar a execução: {e}")
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise RunCancelledError(f"Execução cancelada: {self.reason}")
+
+    def wait(self, timeout: float) -> bool:
+        """Espera até `timeout` segundos; retorna True se o token foi cancelado nesse meio tempo."""
+        return self._event.wait(timeout)
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """Chama `callback` se o token for cancelado enquanto o bloco estiver em execução."""
+        with self._lock:
+            cancelled = self._event.is_set()
+            if not cancelled:
+                key = self._next_id
+                self._next_id += 1
+                self._callbacks[key] = callback
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if not cancelled:
+                    self._callbacks.pop(key, None)
+
+
+def current() -> Optional[CancelToken]:
+    return _current.get()
+
+
+@contextmanager
+def bind(token: Optional[CancelToken]) -> Iterator[Optional[CancelToken]]:
+    """Torna `token` o token da execução atual dentro do bloco."""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def raise_if_cancelled() -> None:
+    token = current()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def cancellable(fn: Callable[[Dict], Dict]) -> Callable[[Dict], Dict]:
+    """Envolve um nó do grafo para interromper a execução antes dele se o token atual foi cancelado."""
+    def wrapper(state: Dict) -> Dict:
+        raise_if_cancelled()
+        return fn(state)
+    return wrapper
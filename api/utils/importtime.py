@@ -0,0 +1,69 @@
+"""Benchmark do tempo de import da API, baseado em `python -X importtime`.
+
+Uso (a partir da pasta api/):
+    python utils/importtime.py [--budget-ms 800] [--runs 3]
+
+Falha (exit code 1) se o import de `main` ultrapassar o orçamento ou se algum
+subsistema pesado do agente for carregado no startup.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Orçamento de import de `main`, em milissegundos (melhor de N execuções)
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "800"))
+# Módulos que só podem ser carregados pela fábrica do agente (agent_factory)
+LAZY_MODULES = ("agent_factory", "chromadb", "langgraph", "openai", "sqlalchemy")
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str = "main"):
+    """Importa o módulo em um processo novo e retorna (tempo total em ms, módulos carregados)."""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=API_DIR, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Falha ao importar {module}:\n{proc.stderr}")
+
+    total_us, modules = 0, set()
+    for match in LINE.finditer(proc.stderr):
+        _, cumulative, indent, name = match.groups()
+        modules.add(name)
+        # Apenas os imports de nível superior, para não contar os aninhados duas vezes
+        if len(indent) == 1:
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    best_ms, modules = min(results, key=lambda r: r[0])
+    leaked = sorted({m.split(".")[0] for m in modules} & set(LAZY_MODULES))
+
+    print(f"Import de main: {best_ms:.1f} ms (melhor de {args.runs}); orçamento: {args.budget_ms:.0f} ms")
+    failed = False
+    if leaked:
+        print(f"FALHA: módulos pesados carregados no startup: {', '.join(leaked)}")
+        failed = True
+    if best_ms > args.budget_ms:
+        print("FALHA: o tempo de import ultrapassou o orçamento.")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
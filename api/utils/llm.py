@@ -0,0 +1,255 @@
+"""Camada resiliente para as chamadas ao LLM: deadlines, retries com jitter, orçamento global de retries,
+circuit breaker por modelo/endpoint, requisições hedged (opcionais) e cancelamento.
+
+O módulo não importa o SDK da OpenAI: as exceções consideradas transitórias são
+informadas por quem cria o `ResilientCaller` (ver agent_factory.py).
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Callable, Dict, Optional, Tuple, Type, TypeVar
+
+from utils import metrics
+from utils.cancellation import CancelToken, RunCancelledError
+
+T = TypeVar("T")
+
+
+class LLMUnavailableError(Exception):
+    """O LLM não respondeu dentro das políticas de retry (erro transitório do provedor)."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """O circuito do modelo/endpoint está aberto; a chamada foi rejeitada sem ir à rede."""
+
+
+class DeadlineExceededError(LLMUnavailableError):
+    """O deadline da requisição acabou antes de a chamada ser concluída."""
+
+
+class CircuitBreaker:
+    """Abre após `failure_threshold` falhas seguidas e libera uma chamada de teste após `reset_timeout` segundos."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Libera a chamada de teste sem contá-la como sucesso nem como falha (ex: a execução foi cancelada)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class RetryBudget:
+    """Orçamento global de retries: cada sucesso deposita `ratio` fichas e cada retry (ou hedge) gasta uma.
+
+    Em um incidente do provedor os retries param rapidamente, em vez de multiplicar a carga.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 20.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class LatencyTracker:
+    """Janela deslizante das latências de sucesso, para estimar o p95."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+
+class ResilientCaller:
+    """Executa chamadas ao LLM com deadline, retries, circuit breaker e hedging, por chave (modelo/endpoint)."""
+
+    def __init__(self, retryable: Tuple[Type[BaseException], ...], max_retries: int = 2,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0, hedge: bool = False,
+                 budget: RetryBudget = None, breaker_factory: Callable[[], CircuitBreaker] = CircuitBreaker):
+        self.retryable = retryable
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.budget = budget or RetryBudget()
+        self._breaker_factory = breaker_factory
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-call")
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault(key, self._breaker_factory())
+
+    def _latency(self, key: str) -> LatencyTracker:
+        with self._lock:
+            return self._latencies.setdefault(key, LatencyTracker())
+
+    def call(self, key: str, fn: Callable[[float], T], node_timeout: float, deadline: Optional[float] = None,
+             cancel: Optional[CancelToken] = None) -> T:
+        """
+        Chama `fn(timeout)` respeitando o menor entre `node_timeout` e o tempo restante até `deadline`
+        (timestamp de `time.time()`), com retries apenas para as exceções transitórias.
+        Se `cancel` for cancelado, a chamada em andamento é abandonada e `RunCancelledError` é levantada.
+        """
+        breaker = self.breaker(key)
+        attempt = 0
+        while True:
+            if cancel is not None:
+                cancel.raise_if_cancelled()
+            timeout = node_timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    metrics.increment("llm_deadline_exceeded")
+                    raise DeadlineExceededError(f"Deadline da requisição esgotado antes da chamada a {key}.")
+                timeout = min(node_timeout, remaining)
+
+            if not breaker.allow():
+                metrics.increment("llm_circuit_rejections")
+                raise CircuitOpenError(f"Circuito aberto para {key}.")
+
+            start = time.monotonic()
+            try:
+                result = self._hedged(key, fn, timeout, cancel) if self.hedge else self._run(key, fn, timeout, cancel)
+            except self.retryable as e:
+                breaker.record_failure()
+                metrics.increment("llm_failures")
+                attempt += 1
+                if attempt > self.max_retries or not self.budget.withdraw():
+                    raise LLMUnavailableError(f"Falha ao chamar {key} após {attempt} tentativa(s): {e}") from e
+                # Backoff exponencial com "full jitter"
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                if deadline is not None and time.time() + delay >= deadline:
+                    metrics.increment("llm_deadline_exceeded")
+                    raise DeadlineExceededError(f"Deadline insuficiente para nova tentativa em {key}.") from e
+                metrics.increment("llm_retries")
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            except RunCancelledError:
+                # O cancelamento não diz nada sobre o provedor; só libera a chamada de teste do half-open
+                breaker.release_trial()
+                raise
+            except Exception:
+                # Erros não transitórios (ex: requisição inválida) mostram que o provedor respondeu
+                breaker.record_success()
+                raise
+
+            breaker.record_success()
+            self.budget.deposit()
+            self._latency(key).record(time.monotonic() - start)
+            return result
+
+    def _run(self, key: str, fn: Callable[[float], T], timeout: float, cancel: Optional[CancelToken]) -> T:
+        if cancel is None:
+            return fn(timeout)
+        future = self._pool.submit(fn, timeout)
+        self._wait_first(key, [future], cancel)
+        return future.result()
+
+    @staticmethod
+    def _wait_first(key: str, futures, cancel: CancelToken) -> None:
+        """
+        Espera a primeira das chamadas em `futures` terminar; se `cancel` for cancelado antes, abandona todas.
+
+        O SDK síncrono não interrompe uma requisição de outra thread: a chamada abandonada segue
+        até o timeout dela no pool, mas ninguém espera mais por ela e a resposta é descartada.
+        """
+        finished = threading.Event()
+        for future in futures:
+            future.add_done_callback(lambda _: finished.set())
+        with cancel.on_cancel(finished.set):
+            finished.wait()
+        if not any(future.done() for future in futures):
+            metrics.increment("llm_calls_abandoned", len(futures))
+            raise RunCancelledError(f"Chamada a {key} abandonada: {cancel.reason}")
+
+    def _hedged(self, key: str, fn: Callable[[float], T], timeout: float, cancel: Optional[CancelToken] = None) -> T:
+        """Dispara uma segunda requisição se a primeira passar do p95 e fica com a que terminar primeiro."""
+        p95 = self._latency(key).p95()
+        if p95 is None or p95 >= timeout:
+            return self._run(key, fn, timeout, cancel)
+
+        first = self._pool.submit(fn, timeout)
+        done, _ = wait([first], timeout=p95)
+        if done or not self.budget.withdraw():
+            if cancel is not None:
+                self._wait_first(key, [first], cancel)
+            return first.result()
+
+        metrics.increment("llm_hedged_requests")
+        second = self._pool.submit(fn, max(timeout - p95, 0.1))
+        if cancel is not None:
+            self._wait_first(key, [first, second], cancel)
+        error = None
+        for future in as_completed([first, second]):
+            try:
+                result = future.result()
+                if future is second:
+                    metrics.increment("llm_hedge_wins")
+                return result
+            except Exception as e:
+                error = e
+        raise error
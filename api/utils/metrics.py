@@ -0,0 +1,27 @@
+"""Contadores de métricas do processo, expostos pelo endpoint /metrics."""
+
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+
+
+def increment(name: str, value: float = 1) -> None:
+    """Incrementa um contador de forma thread-safe."""
+    with _lock:
+        _counters[name] += value
+
+
+def ratio(numerator: str, denominator: str) -> float:
+    """Retorna a razão entre dois contadores (0.0 se o denominador for zero)."""
+    with _lock:
+        total = _counters.get(denominator, 0)
+        return (_counters.get(numerator, 0) / total) if total else 0.0
+
+
+def snapshot() -> Dict[str, float]:
+    """Retorna uma cópia dos contadores atuais."""
+    with _lock:
+        return dict(_counters)
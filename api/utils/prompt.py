@@ -0,0 +1,115 @@
+"""Montagem dos prompts do agente com prefixos estáveis para o cache de prompt do provedor.
+
+O cache de prompt da OpenAI só é aproveitado quando o início das mensagens é
+idêntico byte a byte entre chamadas. Por isso o conteúdo é sempre ordenado do
+mais estável para o mais volátil:
+
+    regras fixas do sistema -> DDL do schema -> histórico -> pergunta/erro
+"""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from utils import metrics
+
+SQL_SYSTEM_PROMPT = """# Tarefa: Gerador de Query SQL
+
+## Persona
+Você é um especialista em SQL, treinado para gerar queries sintaticamente corretas no dialeto **{dialect}**. Sua função é traduzir a pergunta do usuário na query mais precisa possível, usando o schema e as descrições fornecidas como guia semântico.
+
+## Regras
+1.  **Fidelidade ao Schema:** Use apenas as tabelas e colunas definidas no contexto.
+2.  **Relações (JOINs):** Construa `JOINs` corretos com base na lógica das chaves e descrições.
+3.  **Saída Limpa:** Sua resposta final deve ser apenas o código SQL, através da ferramenta `sql_query`.
+4.  **NUNCA** esqueça de trazer dados não nulos (ex: `WHERE column IS NOT NULL`).
+5.  **SEMPRE** coloque as variáveis entre aspas duplas (ex: `WHERE column = "value"`).
+6.  **Limite de Resultados:** Sempre que possível, limite os resultados."""
+
+SCHEMA_PROMPT = """## Contexto: Schema do Banco de Dados
+Abaixo estão os schemas e as descrições das tabelas relevantes para a pergunta.
+
+{tables}"""
+
+
+def join_schemas(schemas) -> str:
+    """Concatena os DDLs em ordem determinística para manter o prefixo estável."""
+    return "\n".join(sorted(set(schemas)))
+
+
+def build_sql_messages(dialect: str, tables: str, question: str, error: Optional[str] = None,
+                       history: Optional[List[Dict[str, str]]] = None,
+                       hints: Optional[str] = None) -> List[Dict[str, str]]:
+    """Monta as mensagens do nó de geração de SQL, do conteúdo estável ao volátil."""
+    volatile = []
+    if hints:
+        volatile.append(f"## Valores Reais do Banco\nUse exatamente estes literais e formatos quando aplicável:\n{hints}")
+    if error:
+        volatile.append(f"## Erro Anterior\nCorrija a query com base neste erro: {error}")
+    volatile.append(f'## Pergunta do Usuário\n"{question}"')
+
+    return [
+        {"role": "system", "content": SQL_SYSTEM_PROMPT.format(dialect=dialect)},
+        {"role": "system", "content": SCHEMA_PROMPT.format(tables=tables)},
+        *(history or []),
+        {"role": "user", "content": "\n\n---\n".join(volatile)},
+    ]
+
+
+class RequestUsage:
+    """Tokens consumidos por uma requisição; pode ser compartilhado entre threads (ex: no batch)."""
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+_request_usage: ContextVar[Optional[RequestUsage]] = ContextVar("request_usage", default=None)
+
+
+@contextmanager
+def track_usage(usage: RequestUsage = None) -> Iterator[RequestUsage]:
+    """Acumula em `usage` o uso de tokens das chamadas feitas dentro do bloco, na thread atual (ver utils/admission.py)."""
+    usage = usage or RequestUsage()
+    token = _request_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _request_usage.reset(token)
+
+
+def record_usage(usage) -> None:
+    """Contabiliza os tokens de prompt e os tokens servidos pelo cache do provedor."""
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+    request_usage = _request_usage.get()
+    if request_usage is not None:
+        request_usage.add(usage.prompt_tokens or 0, usage.completion_tokens or 0)
+
+    metrics.increment("llm_calls")
+    metrics.increment("prompt_tokens", usage.prompt_tokens or 0)
+    metrics.increment("completion_tokens", usage.completion_tokens or 0)
+    metrics.increment("cached_prompt_tokens", cached)
+    if cached:
+        metrics.increment("prompt_cache_hits")
+
+
+def cache_report() -> Dict[str, float]:
+    """Resumo das taxas de acerto do cache de prompt."""
+    return {
+        "prompt_cache_hit_rate": metrics.ratio("prompt_cache_hits", "llm_calls"),
+        "cached_prompt_token_ratio": metrics.ratio("cached_prompt_tokens", "prompt_tokens"),
+    }
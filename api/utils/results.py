@@ -0,0 +1,171 @@
+"""Resultados estruturados das queries: payload colunar tipado e exportação em streaming (NDJSON, Arrow IPC e Parquet).
+
+Arrow e Parquet dependem do pacote opcional `pyarrow`, importado apenas quando usados.
+"""
+
+import datetime
+import decimal
+import json
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+# Quantidade máxima de linhas devolvidas junto com a resposta de /query
+MAX_INLINE_ROWS = 1000
+# Linhas lidas do banco por lote durante os downloads
+STREAM_BATCH_SIZE = 5000
+
+_TYPE_NAMES = (
+    (bool, "boolean"),
+    (int, "integer"),
+    (float, "float"),
+    (decimal.Decimal, "decimal"),
+    (datetime.datetime, "datetime"),
+    (datetime.date, "date"),
+    (bytes, "binary"),
+)
+
+
+def infer_type(values: Sequence[Any]) -> str:
+    """Infere o tipo lógico de uma coluna pelo primeiro valor não nulo."""
+    for value in values:
+        if value is None:
+            continue
+        for python_type, name in _TYPE_NAMES:
+            if isinstance(value, python_type):
+                return name
+        return "string"
+    return "null"
+
+
+def to_columnar(columns: List[str], rows: Sequence[Sequence[Any]], row_count: int = None) -> Dict:
+    """Converte linhas em um payload colunar tipado: {columns: [{name, type}], data: {coluna: [valores]}}."""
+    data = {name: [row[i] for row in rows] for i, name in enumerate(columns)}
+    row_count = len(rows) if row_count is None else row_count
+    return {
+        "columns": [{"name": name, "type": infer_type(data[name])} for name in columns],
+        "data": data,
+        "row_count": row_count,
+        "truncated": row_count > len(rows),
+    }
+
+
+def stream_batches(engine, sql: str, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """Executa a query com cursor do lado do servidor (quando o driver suporta) e gera lotes de linhas."""
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(text(sql))
+        columns = list(result.keys())
+        for partition in result.partitions(batch_size):
+            yield columns, [tuple(row) for row in partition]
+
+
+def fetch_page(engine, sql: str, offset: int, limit: int) -> Dict:
+    """Retorna uma página do resultado no formato colunar, sem materializar o resultado inteiro."""
+    columns, page, skipped = [], [], 0
+    for columns, batch in stream_batches(engine, sql):
+        if skipped + len(batch) <= offset:
+            skipped += len(batch)
+            continue
+        start = max(offset - skipped, 0)
+        # Uma linha a mais que o limite indica se há outra página
+        page.extend(batch[start:start + limit + 1 - len(page)])
+        skipped += len(batch)
+        if len(page) > limit:
+            break
+    payload = to_columnar(columns, page[:limit])
+    payload.update({"offset": offset, "limit": limit, "has_more": len(page) > limit})
+    return payload
+
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f"Tipo não serializável: {type(value)}")
+
+
+def ndjson_stream(engine, sql: str) -> Iterator[bytes]:
+    """Gera o resultado como NDJSON, um objeto por linha."""
+    for columns, batch in stream_batches(engine, sql):
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n" for row in batch
+        ).encode("utf-8")
+
+
+class _ChunkSink:
+    """Arquivo apenas de escrita que acumula bytes para serem drenados a cada lote."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _record_batches(engine, sql: str):
+    """Converte os lotes do banco em RecordBatches do Arrow com um schema estável."""
+    import pyarrow as pa
+
+    schema, null_columns = None, set()
+    for columns, batch in stream_batches(engine, sql):
+        data = {name: [row[i] for row in batch] for i, name in enumerate(columns)}
+        if schema is None:
+            inferred = pa.Table.from_pydict(data).schema
+            # Colunas só com nulos no primeiro lote viram texto, para aceitar os lotes seguintes
+            null_columns = {f.name for f in inferred if pa.types.is_null(f.type)}
+            schema = pa.schema([pa.field(f.name, pa.string()) if f.name in null_columns else f for f in inferred])
+        for name in null_columns:
+            data[name] = [None if v is None else str(v) for v in data[name]]
+        yield schema, pa.RecordBatch.from_pydict(data, schema=schema)
+
+
+def arrow_stream(engine, sql: str) -> Iterator[bytes]:
+    """Gera o resultado no formato Arrow IPC (streaming)."""
+    import pyarrow as pa
+
+    sink, writer = _ChunkSink(), None
+    for schema, batch in _record_batches(engine, sql):
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+def parquet_stream(engine, sql: str) -> Iterator[bytes]:
+    """Gera o resultado como Parquet, com um row group por lote lido do banco."""
+    import pyarrow.parquet as pq
+
+    sink, writer = _ChunkSink(), None
+    for schema, batch in _record_batches(engine, sql):
+        if writer is None:
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_batch(batch)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
@@ -19,6 +19,8 @@ import chromadb
 from chromadb.utils import embedding_functions
 from pydantic import BaseModel, Field
 
+from db.snapshot import load_snapshot, save_snapshot
+
 # --- CONFIGURAÇÃO FIXA ---
 load_dotenv()
 DB_DIALECT = "sqlite"
@@ -29,6 +31,8 @@ TABLES_TO_USE = ["clientes", "produtos", "vendas"]
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CHAT_MODEL = "gpt-4o"
 EMBEDDING_MODEL = "text-embedding-3-small"
+# Snapshot próprio do Streamlit: evita re-embedar as descrições a cada novo processo
+SNAPSHOT_PATH = "db/streamlit_snapshot.json"
 TABLE_DESCRIPTIONS = {
     "clientes": "Esta tabela armazena informações sobre os clientes. Contém nome, cidade e email de cada cliente.",
     "produtos": "Esta tabela contém a lista de todos os produtos disponíveis para venda. Inclui o nome do produto e seu preço unitário.",
@@ -133,7 +137,18 @@ def get_compiled_agent():
     metas = [{"table_name": name, "schema": schemas.get(name, "")} for name in TABLES_TO_USE]
     ids = [f"{name}_doc" for name in TABLES_TO_USE]
     if chroma_collection.count() > 0: chroma_collection.delete(ids=chroma_collection.get()['ids'])
-    chroma_collection.add(documents=docs, metadatas=metas, ids=ids)
+
+    snapshot = load_snapshot(SNAPSHOT_PATH, EMBEDDING_MODEL)
+    if snapshot and snapshot["schemas"] == schemas and snapshot["embeddings"]["documents"] == docs and snapshot["embeddings"]["vectors"]:
+        print("--- REAPROVEITANDO EMBEDDINGS DO SNAPSHOT ---")
+        chroma_collection.add(documents=docs, metadatas=metas, ids=ids, embeddings=snapshot["embeddings"]["vectors"])
+    else:
+        chroma_collection.add(documents=docs, metadatas=metas, ids=ids)
+        save_snapshot(
+            SNAPSHOT_PATH, dialect=DB_DIALECT, connection_string=DB_CONNECTION_STRING,
+            tables=[{"table_name": name, "description": doc} for name, doc in zip(TABLES_TO_USE, docs)],
+            schemas=schemas, collection=chroma_collection, embedding_model=EMBEDDING_MODEL
+        )
 
     # 4. Construir o Grafo
     workflow = StateGraph(GraphState)
@@ -0,0 +1,137 @@
+"""Consulta e reprodução dos traces gravados pela API (ver utils/tracing.py).
+
+Uso (a partir da pasta api/):
+    python -m utils.traces slowest --limit 20
+    python -m utils.traces show <run_id>
+    python -m utils.traces replay <run_id>
+
+`replay` restaura o agente a partir do snapshot e executa a pergunta de novo com um
+LLM simulado, que devolve as mesmas saídas com as mesmas latências da execução
+original. O SQL roda de verdade no banco, então o perfil de tempo por nó pode ser
+comparado com o original (ex: depois de mudar índices ou o volume de dados).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Dict
+
+from db.traces import TraceStore
+from utils.colors import Colors
+
+
+class ReplayClient:
+    """Substituto do cliente da OpenAI que devolve as chamadas gravadas no trace, na mesma ordem."""
+
+    def __init__(self, trace: Dict):
+        self._calls = deque(call for call in trace["llm_call_log"] if "output" in call)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        if not self._calls:
+            raise RuntimeError("A execução divergiu do trace: chamada ao LLM sem correspondente gravado.")
+        call = self._calls.popleft()
+        time.sleep(call["duration_ms"] / 1000)
+        output = call["output"]
+        tool_calls = None
+        if "tool_arguments" in output:
+            tool_calls = [SimpleNamespace(function=SimpleNamespace(arguments=output["tool_arguments"]))]
+        message = SimpleNamespace(content=output.get("content"), tool_calls=tool_calls)
+        usage = SimpleNamespace(prompt_tokens=call.get("prompt_tokens", 0), completion_tokens=call.get("completion_tokens", 0),
+                                prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def print_slowest(store: TraceStore, limit: int) -> None:
+    runs = store.slowest(limit)
+    if not runs:
+        print(f"{Colors.YELLOW}Nenhum trace registrado.{Colors.ENDC}")
+        return
+    print(f"{Colors.BOLD}{'run_id':<32}  {'ms':>9}  {'status':<9} {'retries':>7} {'tokens':>7}  pergunta{Colors.ENDC}")
+    for run in runs:
+        tokens = (run["prompt_tokens"] or 0) + (run["completion_tokens"] or 0)
+        print(f"{run['run_id']:<32}  {run['duration_ms']:>9.1f}  {run['status']:<9} {run['retries']:>7} {tokens:>7}  {run['question'][:60]}")
+
+
+def print_profile(original: Dict, replayed: Dict) -> None:
+    """Compara o tempo por nó da execução original com o da reprodução."""
+    print(f"{Colors.BOLD}{'nó':<24} {'original (ms)':>14} {'replay (ms)':>12}{Colors.ENDC}")
+    for before, after in zip(original["spans"], replayed["spans"]):
+        node = before["node"] if before["node"] == after["node"] else f"{before['node']}/{after['node']}"
+        print(f"{node:<24} {before['duration_ms']:>14.1f} {after['duration_ms']:>12.1f}")
+    if len(original["spans"]) != len(replayed["spans"]):
+        print(f"{Colors.YELLOW}Número de nós diferente: {len(original['spans'])} no original, {len(replayed['spans'])} na reprodução.{Colors.ENDC}")
+    print(f"{Colors.BOLD}{'total':<24} {original['duration_ms']:>14.1f} {replayed['duration_ms']:>12.1f}{Colors.ENDC}")
+
+
+def replay(trace: Dict, snapshot_path: str) -> int:
+    from sqlalchemy import create_engine
+
+    import agent_factory
+    from db.snapshot import load_snapshot, resolve_credentials
+    from utils import tracing
+
+    if not trace.get("tables"):
+        print(f"{Colors.RED}O trace {trace['run_id']} não registrou as tabelas roteadas; não é possível reproduzi-lo "
+              f"sem chamar a API de embeddings.{Colors.ENDC}", file=sys.stderr)
+        return 1
+
+    snapshot = load_snapshot(snapshot_path, agent_factory.EMBEDDING_MODEL)
+    if snapshot is None:
+        print(f"{Colors.RED}Snapshot não encontrado em '{snapshot_path}'. Configure o agente pela API primeiro.{Colors.ENDC}", file=sys.stderr)
+        return 1
+
+    db_engine = create_engine(resolve_credentials(snapshot["credentials_ref"]))
+    tables = [argparse.Namespace(**t) for t in snapshot["tables"]]
+    agent, _, profiler = agent_factory.build_agent(
+        db_engine, snapshot["dialect"], tables, snapshot["schemas"], embeddings=snapshot["embeddings"]
+    )
+    agent_factory._client = ReplayClient(trace)
+    try:
+        # As tabelas roteadas vêm do trace: o roteamento não chama a API de embeddings
+        initial_state = {"question": trace["question"], "history": [], "tables": trace["tables"],
+                         "deadline": time.time() + agent_factory.REQUEST_DEADLINE}
+        with tracing.run_trace(trace["question"], source="replay") as replayed:
+            agent.invoke(initial_state, {"recursion_limit": 15})
+    finally:
+        profiler.stop()
+        db_engine.dispose()
+
+    print_profile(trace, replayed.to_dict())
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--traces", default=os.getenv("AGENT_TRACE_PATH", "db/traces.db"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    slowest = commands.add_parser("slowest", help="Lista as execuções mais lentas")
+    slowest.add_argument("--limit", type=int, default=20)
+    show = commands.add_parser("show", help="Mostra o trace completo de uma execução")
+    show.add_argument("run_id")
+    replay_parser = commands.add_parser("replay", help="Reproduz uma execução com o LLM simulado")
+    replay_parser.add_argument("run_id")
+    replay_parser.add_argument("--snapshot", default=os.getenv("AGENT_SNAPSHOT_PATH", "db/agent_snapshot.json"))
+    args = parser.parse_args()
+
+    store = TraceStore(args.traces)
+    if args.command == "slowest":
+        print_slowest(store, args.limit)
+        return 0
+
+    trace = store.get(args.run_id)
+    if trace is None:
+        print(f"{Colors.RED}Trace '{args.run_id}' não encontrado.{Colors.ENDC}", file=sys.stderr)
+        return 1
+    if args.command == "show":
+        print(json.dumps(trace, ensure_ascii=False, indent=2))
+        return 0
+    return replay(trace, args.snapshot)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Trace de cada execução do grafo: tempo por nó, chamadas ao LLM (latência, tokens e saída),
+SQLs candidatos, tempo e linhas da execução no banco, retries e erros.
+
+O trace da execução atual fica em uma ContextVar, então os nós e `create_chat_completion`
+registram nele sem receber nada como parâmetro. As saídas do LLM são guardadas para que
+a execução possa ser reproduzida com um LLM simulado (ver utils/traces.py).
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from utils.cancellation import RunCancelledError
+
+_current: ContextVar[Optional["RunTrace"]] = ContextVar("run_trace", default=None)
+
+
+class RunTrace:
+    """Eventos de uma execução do grafo."""
+
+    def __init__(self, question: str, source: str = "api"):
+        self.run_id = uuid.uuid4().hex
+        self.question = question
+        self.source = source
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.llm_calls = []
+        self.status = "running"
+        self.details: Dict[str, Any] = {}
+        self._duration_ms = None
+        self._lock = threading.Lock()
+
+    def _elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._start) * 1000, 2)
+
+    @contextmanager
+    def span(self, node: str) -> Iterator[Dict]:
+        span = {"node": node, "start_ms": self._elapsed_ms()}
+        try:
+            yield span
+        except Exception as e:
+            span["exception"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["duration_ms"] = round(self._elapsed_ms() - span["start_ms"], 2)
+            with self._lock:
+                self.spans.append(span)
+
+    def record_llm_call(self, node: str, model: str, seconds: float, response=None, error: Exception = None) -> None:
+        call = {"node": node, "model": model, "duration_ms": round(seconds * 1000, 2)}
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            call.update(prompt_tokens=usage.prompt_tokens or 0, completion_tokens=usage.completion_tokens or 0)
+        if response is not None:
+            message = response.choices[0].message
+            tool_calls = getattr(message, "tool_calls", None)
+            call["output"] = {"tool_arguments": tool_calls[0].function.arguments} if tool_calls else {"content": message.content}
+        if error is not None:
+            call["error"] = f"{type(error).__name__}: {error}"
+        with self._lock:
+            self.llm_calls.append(call)
+
+    def complete(self, final_state: Dict) -> None:
+        """Registra o desfecho da execução a partir do estado final do grafo."""
+        self.status = "error" if final_state.get("error") else "ok"
+        self.details.update(
+            retries=final_state.get("retries", 0),
+            error=final_state.get("error"),
+            sql_query=final_state.get("sql_query"),
+            tables=final_state.get("tables"),
+            history_messages=len(final_state.get("history") or []),
+        )
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            llm_calls = list(self.llm_calls)
+            spans = list(self.spans)
+        return {
+            "run_id": self.run_id,
+            "source": self.source,
+            "question": self.question,
+            "started_at": self.started_at,
+            "duration_ms": self._duration_ms,
+            "status": self.status,
+            "retries": self.details.get("retries", 0),
+            "llm_calls": len(llm_calls),
+            "prompt_tokens": sum(c.get("prompt_tokens", 0) for c in llm_calls),
+            "completion_tokens": sum(c.get("completion_tokens", 0) for c in llm_calls),
+            **self.details,
+            "spans": spans,
+            "llm_call_log": llm_calls,
+        }
+
+    def finish(self) -> None:
+        self._duration_ms = self._elapsed_ms()
+
+
+def current() -> Optional[RunTrace]:
+    return _current.get()
+
+
+@contextmanager
+def run_trace(question: str, store=None, source: str = "api") -> Iterator[RunTrace]:
+    """Abre o trace de uma execução e o grava em `store` (ex: db/traces.TraceStore) ao final."""
+    trace = RunTrace(question, source)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.status = "cancelled" if isinstance(e, RunCancelledError) else "exception"
+        trace.details["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        trace.finish()
+        if store is not None:
+            try:
+                store.save(trace.to_dict())
+            except Exception as e:
+                # O trace nunca deve derrubar a requisição
+                print(f"Falha ao gravar o trace {trace.run_id}: {e}")
+
+
+def _summarize_update(node: str, update: Dict) -> Dict:
+    """Extrai do retorno de um nó o que interessa ao trace."""
+    summary = {}
+    if update.get("sql_query") and node == "generate_sql":
+        summary["sql_query"] = update["sql_query"]
+    if update.get("query_data"):
+        summary["rows"] = update["query_data"]["row_count"]
+    if update.get("error"):
+        summary["error"] = update["error"]
+    return summary
+
+
+def traced_node(node: str, fn: Callable[[Dict], Dict]) -> Callable[[Dict], Dict]:
+    """Envolve um nó do grafo para registrar seu tempo e resultado no trace atual (se houver)."""
+    def wrapper(state: Dict) -> Dict:
+        trace = current()
+        if trace is None:
+            return fn(state)
+        with trace.span(node) as span:
+            update = fn(state)
+            span.update(_summarize_update(node, update or {}))
+        if node == "route_tables":
+            # Gravadas já aqui, e não só em complete(): o replay precisa delas mesmo se a execução falhar
+            trace.details["tables"] = (update or {}).get("tables") or state.get("tables")
+        return update
+    return wrapper
+
+
+class TracedAgent:
+    """Grafo compilado que abre um trace por execução (reaproveita o trace atual, se já houver um)."""
+
+    def __init__(self, graph, store=None):
+        self.graph = graph
+        self.store = store
+
+    def invoke(self, state: Dict, config: Dict = None) -> Dict:
+        trace = current()
+        if trace is not None:
+            final_state = self.graph.invoke(state, config)
+            trace.complete(final_state)
+            return final_state
+        source = "batch" if state.get("result_cache") is not None else "api"
+        with run_trace(state["question"], self.store, source) as trace:
+            final_state = self.graph.invoke(state, config)
+            trace.complete(final_state)
+            return final_state
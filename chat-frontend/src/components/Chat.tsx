@@ -26,6 +26,11 @@ const Chat: React.FC<ChatProps> = ({ configuredTables }) => { // ALTERADO: Receb
     const [isLoading, setIsLoading] = useState(false);
 
     const messagesEndRef = useRef<HTMLDivElement>(null);
+    // Requisição em andamento: abortar o fetch fecha a conexão e o backend interrompe o processamento
+    const abortControllerRef = useRef<AbortController | null>(null);
+
+    // Cancela a pergunta em andamento se o chat for desmontado
+    useEffect(() => () => abortControllerRef.current?.abort(), []);
 
     // ALTERADO: O useEffect agora apenas monta a mensagem de boas-vindas.
     // Ele não busca mais os dados, pois já os recebeu via props.
@@ -62,11 +67,15 @@ const Chat: React.FC<ChatProps> = ({ configuredTables }) => { // ALTERADO: Receb
         setInput('');
         setIsLoading(true);
 
+        const controller = new AbortController();
+        abortControllerRef.current = controller;
+
         try {
             const response = await fetch(`${API_URL}/query`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ question: input }),
+                signal: controller.signal,
             });
 
             if (!response.ok) throw new Error(`Erro na API: ${response.statusText}`);
@@ -74,6 +83,10 @@ const Chat: React.FC<ChatProps> = ({ configuredTables }) => { // ALTERADO: Receb
             const botMessage: Message = { text: data.answer, sender: 'bot' };
             setMessages(prev => [...prev, botMessage]);
         } catch (error) {
+            if (controller.signal.aborted) {
+                setMessages(prev => [...prev, { text: "Pergunta cancelada.", sender: 'bot' }]);
+                return;
+            }
             console.error("Falha ao comunicar com o backend:", error);
             const errorMessage: Message = {
                 text: "Desculpe, não consegui processar sua pergunta. Tente novamente.",
@@ -81,10 +94,15 @@ const Chat: React.FC<ChatProps> = ({ configuredTables }) => { // ALTERADO: Receb
             };
             setMessages(prev => [...prev, errorMessage]);
         } finally {
+            abortControllerRef.current = null;
             setIsLoading(false);
         }
     };
 
+    const handleCancel = () => {
+        abortControllerRef.current?.abort();
+    };
+
     return (
         <div className="chat-container">
             <header className="chat-header">
@@ -132,9 +150,15 @@ const Chat: React.FC<ChatProps> = ({ configuredTables }) => { // ALTERADO: Receb
                         disabled={isLoading}
                         autoFocus
                     />
-                    <button type="submit" disabled={isLoading}>
-                        Enviar
-                    </button>
+                    {isLoading ? (
+                        <button type="button" className="cancel" onClick={handleCancel}>
+                            Cancelar
+                        </button>
+                    ) : (
+                        <button type="submit">
+                            Enviar
+                        </button>
+                    )}
                 </form>
             </footer>
         </div>